@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+from benchmarks.fake_aw_server import FakeAwServer, generate_buckets, APPS
+from goaltracker.Goal import Goal, GoalTypes
+from goaltracker.awfetcher import GoalQuery, fetch_hours, fetch_hours_batch
+from goaltracker.awtransport import set_server_url
+from goaltracker.ProgressAccumulator import ProgressAccumulator
+from goaltracker.awmirror import EventMirror
+
+# Measures the fetch strategies against the fake aw-server, run from the repository root:
+#   python -m benchmarks.bench_awfetcher --goal-types daily monthly --goals 1 10 --output bench_output.txt
+
+def generate_filters(rule_count : int, seed : int) -> list:
+    rng = random.Random(seed)
+    words = [app for app, _ in APPS] + ["project", "GitHub", "YouTube", "Slack", "Inbox", "python", "README"]
+    filters = []
+    for i in range(rule_count):
+        # Every third rule is nested under an earlier one
+        path = ["Category{}".format(i)] if i % 3 != 2 else filters[i - 1][0] + ["Sub{}".format(i)]
+        filters.append([path, {"type": "regex", "ignore_case": rng.random() < 0.5, "regex": "|".join(rng.sample(words, 2))}])
+    return filters
+
+def create_goal_queries(goal_type : str, goal_count : int, rule_count : int, filter_afk : bool) -> list:
+    goal_queries = []
+    for i in range(goal_count):
+        begin_date, end_date = Goal(goal_type=goal_type).get_date_range()
+        goal_queries.append(GoalQuery(i, generate_filters(rule_count, seed=i), begin_date, end_date, filter_afk))
+    return goal_queries
+
+class Strategy:
+    def __init__(self, name : str, fetch, prepare = None):
+        self.name = name
+        # prepare runs once before the measured iterations, e.g. to warm caches
+        self.prepare = prepare
+        self.fetch = fetch
+
+def create_strategies(server_url : str, mirror_path : str) -> dict:
+    warm_accumulator = ProgressAccumulator()
+    mirror = EventMirror(db_path=mirror_path)
+
+    def fetch_per_goal(goal_queries):
+        return {goal_query.key: fetch_hours(goal_query.filters, goal_query.begin_date, goal_query.end_date, goal_query.filter_afk)
+            for goal_query in goal_queries}
+
+    def fetch_mirror(goal_queries):
+        mirror.sync()
+        return mirror.fetch_hours_batch(goal_queries)
+
+    strategies = [
+        Strategy("per_goal", fetch_per_goal),
+        Strategy("batch", fetch_hours_batch),
+        Strategy("incremental_cold", lambda goal_queries: ProgressAccumulator().fetch_hours(goal_queries)),
+        Strategy("incremental_warm", warm_accumulator.fetch_hours, prepare=warm_accumulator.fetch_hours),
+        Strategy("mirror", fetch_mirror, prepare=lambda goal_queries: mirror.sync()),
+    ]
+    return {strategy.name: strategy for strategy in strategies}
+
+def percentile(values : list, percent : float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(percent / 100 * (len(values) - 1)))))
+    return values[index]
+
+def run_case(server : FakeAwServer, strategy : Strategy, goal_queries : list, iterations : int) -> dict:
+    if not strategy.prepare is None:
+        strategy.prepare(goal_queries)
+
+    latencies = []
+    server.stats.reset()
+    for _ in range(iterations):
+        begin = time.perf_counter()
+        results = strategy.fetch(goal_queries)
+        latencies.append(time.perf_counter() - begin)
+        if any(hours is None for hours in results.values()):
+            raise RuntimeError("{} failed to fetch some goals".format(strategy.name))
+    stats = server.stats.snapshot()
+
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "requests": stats["requests"] / iterations,
+        "bytes_sent": stats["bytes_received"] / iterations,
+        "bytes_received": stats["bytes_sent"] / iterations,
+        "server_cpu_ms": stats["cpu_time"] / iterations * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark goaltracker fetch strategies against a fake aw-server")
+    parser.add_argument("--strategies", nargs="+", default=["per_goal", "batch", "incremental_cold", "incremental_warm", "mirror"])
+    parser.add_argument("--goal-types", nargs="+", default=[GoalTypes.DAILY, GoalTypes.MONTHLY, GoalTypes.YEARLY])
+    parser.add_argument("--goals", nargs="+", type=int, default=[1, 10])
+    parser.add_argument("--rules", nargs="+", type=int, default=[5])
+    parser.add_argument("--filter-afk", nargs="+", type=int, default=[0, 1], help="0 and/or 1")
+    parser.add_argument("--days", type=int, default=366, help="days of generated history")
+    parser.add_argument("--events-per-hour", type=int, default=12)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", help="append results as json lines to this file")
+    args = parser.parse_args()
+
+    server = FakeAwServer(buckets=generate_buckets(days=args.days, events_per_hour=args.events_per_hour)).start()
+    set_server_url(server.url)
+    mirror_folder = tempfile.TemporaryDirectory()
+    strategies = create_strategies(server.url, os.path.join(mirror_folder.name, "awmirror.db"))
+
+    header = "{:<17} {:<8} {:>5} {:>5} {:>3} {:>10} {:>10} {:>10} {:>8} {:>12} {:>12} {:>12}".format(
+        "strategy", "type", "goals", "rules", "afk", "p50 ms", "p95 ms", "p99 ms", "reqs", "sent B", "recv B", "server ms")
+    print(header)
+    print("-" * len(header))
+
+    output = open(args.output, "a") if args.output else None
+    try:
+        for goal_type in args.goal_types:
+            for goal_count in args.goals:
+                for rule_count in args.rules:
+                    for filter_afk in args.filter_afk:
+                        goal_queries = create_goal_queries(goal_type, goal_count, rule_count, bool(filter_afk))
+                        for name in args.strategies:
+                            result = run_case(server, strategies[name], goal_queries, args.iterations)
+                            print("{:<17} {:<8} {:>5} {:>5} {:>3} {:>10.1f} {:>10.1f} {:>10.1f} {:>8.1f} {:>12.0f} {:>12.0f} {:>12.1f}".format(
+                                name, goal_type, goal_count, rule_count, filter_afk, result["p50_ms"], result["p95_ms"], result["p99_ms"],
+                                result["requests"], result["bytes_sent"], result["bytes_received"], result["server_cpu_ms"]))
+                            sys.stdout.flush()
+                            if not output is None:
+                                result.update({"strategy": name, "goal_type": goal_type, "goals": goal_count,
+                                    "rules": rule_count, "filter_afk": bool(filter_afk), "time": time.time()})
+                                output.write(json.dumps(result) + "\n")
+    finally:
+        if not output is None:
+            output.close()
+        server.stop()
+        mirror_folder.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+from datetime import datetime, timezone, timedelta
+
+from benchmarks.fake_aw_server import FakeAwServer, generate_buckets
+from benchmarks.bench_awfetcher import generate_filters
+from goaltracker import localengine
+from goaltracker.awfetcher import GoalQuery, fetch_hours_batch
+from goaltracker.awtransport import set_server_url, get_transport
+from goaltracker.awbuckets import WINDOW_BUCKET_TYPE
+from goaltracker.awmirror import EventMirror
+from goaltracker.categorize import compile_rules, categorize_data, UNCATEGORIZED
+
+# Checks that the local categorization of the mirror gives the same category durations and goal
+# hours as the aw-server query path, run from the repository root:
+#   python -m benchmarks.check_parity [--server-url http://localhost:5600]
+
+# Sibling and nested rules that match the same events, the server gives ties to the last rule
+TIE_FILTERS = [
+    [["Work"], {"type": "regex", "regex": "project|GitHub"}],
+    [["Work", "Code"], {"type": "regex", "regex": "Visual Studio Code|python"}],
+    [["Work", "Docs"], {"type": "regex", "regex": "README|GitHub"}],
+    [["Work", "Review"], {"type": "regex", "regex": "Pull request", "ignore_case": True}],
+    [["Chat"], {"type": "regex", "regex": "Slack|Thunderbird"}],
+    [["Media"], {"type": "regex", "regex": "YouTube|News"}],
+    [["Media"], {"type": "regex", "regex": "Video"}],
+]
+
+# Sums run in a different order on both sides, allow for float rounding
+TOLERANCE = 0.001 # seconds
+
+def fetch_server_durations(filters : list, begin_date : datetime, end_date : datetime) -> dict:
+    query = [
+        "events = flood(query_bucket(find_bucket(\"aw-watcher-window\")));",
+        "events = merge_events_by_keys(categorize(events, {}), [\"$category\"]);".format(json.dumps(filters)),
+        "RETURN = events;",
+    ]
+    data = json.dumps({"timeperiods": ["{}/{}".format(begin_date.isoformat(), end_date.isoformat())], "query": query})
+    response = get_transport().query(data)
+    response.raise_for_status()
+    durations = {}
+    for event in response.json()[0]:
+        category = tuple(event["data"]["$category"])
+        if category != tuple(UNCATEGORIZED):
+            durations[category] = durations.get(category, 0) + event["duration"]
+    return durations
+
+def python_durations(filters : list, events : list) -> dict:
+    rules = compile_rules(filters)
+    durations = {}
+    for begin, end, data in events:
+        category = tuple(categorize_data(rules, data))
+        if category != tuple(UNCATEGORIZED):
+            durations[category] = durations.get(category, 0) + end - begin
+    return durations
+
+def compare_durations(name : str, expected : dict, actual : dict) -> list:
+    mismatches = []
+    for category in sorted(set(expected) | set(actual)):
+        if abs(expected.get(category, 0) - actual.get(category, 0)) > TOLERANCE:
+            mismatches.append("{}: {} server {:.3f}s, local {:.3f}s".format(name, list(category), expected.get(category, 0), actual.get(category, 0)))
+    return mismatches
+
+def check_parity(mirror : EventMirror, filter_sets : list, begin_date : datetime, end_date : datetime) -> list:
+    mirror.sync()
+    window_bucket_id = mirror.get_bucket_id(WINDOW_BUCKET_TYPE)
+    events = mirror.get_events(window_bucket_id, begin_date.timestamp(), end_date.timestamp())
+
+    mismatches = []
+    goal_queries = []
+    for i, filters in enumerate(filter_sets):
+        server_durations = fetch_server_durations(filters, begin_date, end_date)
+        mismatches += compare_durations("python filters {}".format(i), server_durations, python_durations(filters, events))
+        if localengine.is_available():
+            local_durations = localengine.category_durations(localengine.EventColumns(events), localengine.CategoryMatcher(filters))
+            mismatches += compare_durations("numpy filters {}".format(i), server_durations, local_durations)
+        for filter_afk in (False, True):
+            goal_queries.append(GoalQuery((i, filter_afk), filters, begin_date, end_date, filter_afk))
+
+    server_hours = fetch_hours_batch(goal_queries)
+    mirror_hours = mirror.fetch_hours_batch(goal_queries)
+    for goal_query in goal_queries:
+        expected, actual = server_hours[goal_query.key], mirror_hours[goal_query.key]
+        if expected is None or actual is None or abs(expected - actual) * 3600 > TOLERANCE:
+            mismatches.append("hours filters {} afk {}: server {}, mirror {}".format(*goal_query.key, expected, actual))
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the local categorization with the aw-server query path")
+    parser.add_argument("--server-url", help="aw-server to compare against, a generated fake aw-server by default")
+    parser.add_argument("--days", type=int, default=7, help="days of history to compare")
+    parser.add_argument("--rules", type=int, default=12, help="rules of the generated filter sets")
+    args = parser.parse_args()
+
+    server = None
+    if args.server_url is None:
+        server = FakeAwServer(buckets=generate_buckets(days=args.days, events_per_hour=30)).start()
+        set_server_url(server.url)
+    else:
+        set_server_url(args.server_url)
+
+    end_date = datetime.now(timezone.utc)
+    begin_date = end_date - timedelta(days=args.days)
+    filter_sets = [TIE_FILTERS] + [generate_filters(args.rules, seed) for seed in range(3)]
+    mirror_folder = tempfile.TemporaryDirectory()
+    mirror = EventMirror(db_path=os.path.join(mirror_folder.name, "awmirror.db"), history_days=args.days + 1)
+    try:
+        mismatches = check_parity(mirror, filter_sets, begin_date, end_date)
+    finally:
+        mirror.close()
+        mirror_folder.cleanup()
+        if not server is None:
+            server.stop()
+
+    for mismatch in mismatches:
+        print(mismatch)
+    print("{} filter sets, {} mismatches{}".format(len(filter_sets), len(mismatches),
+        "" if localengine.is_available() else " (numpy not installed, local engine skipped)"))
+    sys.exit(1 if len(mismatches) > 0 else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+import re
+import sys
+import json
+import time
+import random
+import bisect
+import threading
+from datetime import datetime, timezone, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# Stand-in for aw-server answering the query and bucket apis from generated buckets.
+# Only the query functions used by goaltracker are implemented.
+
+APPS = [
+    ("code", ["main.py - project - Visual Studio Code", "README.md - project - Visual Studio Code"]),
+    ("firefox", ["News - Mozilla Firefox", "Pull request #12 - GitHub - Mozilla Firefox", "Video - YouTube"]),
+    ("gnome-terminal", ["bash", "python -m goaltracker", "htop"]),
+    ("slack", ["general | team - Slack", "random | team - Slack"]),
+    ("thunderbird", ["Inbox - Mozilla Thunderbird"]),
+]
+
+class Event:
+    __slots__ = ("id", "begin", "duration", "data")
+
+    def __init__(self, event_id, begin : float, duration : float, data : dict):
+        self.id = event_id
+        self.begin = begin
+        self.duration = duration
+        self.data = data
+
+    @property
+    def end(self):
+        return self.begin + self.duration
+
+    def with_range(self, begin : float, end : float):
+        return Event(self.id, begin, end - begin, self.data)
+
+    def with_data(self, data : dict):
+        return Event(self.id, self.begin, self.duration, data)
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "timestamp": datetime.fromtimestamp(self.begin, timezone.utc).isoformat(),
+            "duration": self.duration,
+            "data": self.data
+        }
+
+class Bucket:
+    def __init__(self, bucket_id : str, bucket_type : str, hostname : str, events : list):
+        self.bucket_id = bucket_id
+        self.bucket_type = bucket_type
+        self.hostname = hostname
+        self.events = sorted(events, key=lambda event: event.begin)
+        self.begins = [event.begin for event in self.events]
+        # Longest event, bounds how far back an overlapping event can start
+        self.max_duration = max((event.duration for event in self.events), default=0)
+
+    def get_events(self, begin : float, end : float) -> list:
+        # Events overlapping the range, clipped to it like aw-server does
+        first = bisect.bisect_left(self.begins, begin - self.max_duration)
+        last = bisect.bisect_left(self.begins, end)
+        result = []
+        for event in self.events[first:last]:
+            clipped_begin, clipped_end = max(event.begin, begin), min(event.end, end)
+            if clipped_end > clipped_begin:
+                result.append(event.with_range(clipped_begin, clipped_end))
+        return result
+
+    def to_json(self):
+        return {"id": self.bucket_id, "type": self.bucket_type, "hostname": self.hostname, "client": "fake-aw-server"}
+
+def generate_buckets(days : int = 31, events_per_hour : int = 30, hostname : str = "fakehost", seed : int = 0, now : float = None) -> dict:
+    rng = random.Random(seed)
+    if now is None:
+        now = time.time()
+    begin = now - days * 24 * 60 * 60
+
+    window_events = []
+    timestamp = begin
+    mean_duration = 60 * 60 / events_per_hour
+    while timestamp < now:
+        app, titles = rng.choice(APPS)
+        duration = rng.uniform(0.2, 1.8) * mean_duration
+        window_events.append(Event(len(window_events), timestamp, duration, {"app": app, "title": rng.choice(titles)}))
+        # Small gaps between events, as flood would see them
+        timestamp += duration + rng.uniform(0, 2)
+
+    afk_events = []
+    timestamp = begin
+    not_afk = True
+    while timestamp < now:
+        duration = rng.uniform(5, 60) * 60 if not_afk else rng.uniform(3, 30) * 60
+        afk_events.append(Event(len(afk_events), timestamp, duration, {"status": "not-afk" if not_afk else "afk"}))
+        timestamp += duration
+        not_afk = not not_afk
+
+    return {
+        "aw-watcher-window_{}".format(hostname): Bucket("aw-watcher-window_{}".format(hostname), "currentwindow", hostname, window_events),
+        "aw-watcher-afk_{}".format(hostname): Bucket("aw-watcher-afk_{}".format(hostname), "afkstatus", hostname, afk_events),
+    }
+
+def parse_timestamp(timestamp : str) -> float:
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+
+def categorize(events : list, classes : list) -> list:
+    # Deepest matching category wins and the last matching rule on ties, like aw-core's _pick_deepest_cat
+    rules = []
+    for category, rule in classes:
+        if rule.get("regex"):
+            rules.append((category, re.compile(rule["regex"], re.IGNORECASE if rule.get("ignore_case") else 0), rule.get("select_keys")))
+
+    result = []
+    for event in events:
+        best = ["Uncategorized"]
+        for category, regex, select_keys in rules:
+            values = [event.data.get(key) for key in select_keys] if select_keys else event.data.values()
+            if any(isinstance(value, str) and regex.search(value) for value in values) and len(category) >= len(best):
+                best = category
+        data = dict(event.data)
+        data["$category"] = best
+        result.append(event.with_data(data))
+    return result
+
+def filter_period_intersect(events : list, periods : list) -> list:
+    result = []
+    periods = sorted(periods, key=lambda period: period.begin)
+    for event in events:
+        for period in periods:
+            if period.begin >= event.end:
+                break
+            begin, end = max(event.begin, period.begin), min(event.end, period.end)
+            if end > begin:
+                result.append(event.with_range(begin, end))
+    return result
+
+def period_union(events1 : list, events2 : list) -> list:
+    merged = []
+    for event in sorted(events1 + events2, key=lambda event: event.begin):
+        if len(merged) > 0 and event.begin <= merged[-1].end:
+            merged[-1] = merged[-1].with_range(merged[-1].begin, max(merged[-1].end, event.end))
+        else:
+            merged.append(Event(None, event.begin, event.duration, {}))
+    return merged
+
+def merge_events_by_keys(events : list, keys : list) -> list:
+    merged = {}
+    for event in events:
+        merge_key = json.dumps([event.data.get(key) for key in keys])
+        if merge_key in merged:
+            merged[merge_key].duration += event.duration
+        else:
+            merged[merge_key] = Event(None, event.begin, event.duration, {key: event.data.get(key) for key in keys if key in event.data})
+    return list(merged.values())
+
+TOKEN_REGEX = re.compile(r'\s*(?:(?P<number>-?\d+(?:\.\d+)?)|(?P<string>"(?:[^"\\]|\\.)*")|(?P<name>[A-Za-z_][A-Za-z0-9_]*)|(?P<symbol>[\[\]{}(),:]))')
+
+class QueryInterpreter:
+    def __init__(self, buckets : dict, begin : float, end : float):
+        self.buckets = buckets
+        self.begin = begin
+        self.end = end
+        self.variables = {}
+        self.functions = {
+            "find_bucket": self.find_bucket,
+            "query_bucket": lambda bucket_id: self.buckets[bucket_id].get_events(self.begin, self.end),
+            "flood": lambda events: events,
+            "filter_keyvals": lambda events, key, values: [event for event in events if event.data.get(key) in values],
+            "exclude_keyvals": lambda events, key, values: [event for event in events if event.data.get(key) not in values],
+            "filter_period_intersect": filter_period_intersect,
+            "period_union": period_union,
+            "concat": lambda *event_lists: [event for events in event_lists for event in events],
+            "categorize": categorize,
+            "merge_events_by_keys": merge_events_by_keys,
+            "sort_by_duration": lambda events: sorted(events, key=lambda event: -event.duration),
+            "sum_durations": lambda events: sum(event.duration for event in events),
+        }
+
+    def find_bucket(self, prefix : str, hostname : str = None):
+        for bucket_id, bucket in self.buckets.items():
+            if bucket_id.startswith(prefix) and (hostname is None or bucket.hostname == hostname):
+                return bucket_id
+        raise KeyError("No bucket found for {}".format(prefix))
+
+    def run(self, query : list):
+        for statement in " ".join(query).split(";"):
+            statement = statement.strip()
+            if len(statement) == 0:
+                continue
+            name, expression = statement.split("=", 1)
+            self.tokens = [token for token in TOKEN_REGEX.finditer(expression) if token.group(0).strip()]
+            self.position = 0
+            self.variables[name.strip()] = self.parse_value()
+        return self.to_json(self.variables.get("RETURN"))
+
+    def peek(self) -> str:
+        return self.tokens[self.position].group(0).strip()
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse_list(self, closing : str) -> list:
+        values = []
+        while self.peek() != closing:
+            values.append(self.parse_value())
+            if self.peek() == ",":
+                self.take()
+        self.take()
+        return values
+
+    def parse_value(self):
+        token = self.take()
+        if token.group("number") or token.group("string"):
+            return json.loads(token.group(0))
+        if token.group("name"):
+            name = token.group("name")
+            if name in ("true", "false", "null"):
+                return json.loads(name)
+            if self.position < len(self.tokens) and self.peek() == "(":
+                self.take()
+                return self.functions[name](*self.parse_list(")"))
+            return self.variables[name]
+        symbol = token.group("symbol")
+        if symbol == "[":
+            return self.parse_list("]")
+        if symbol == "{":
+            result = {}
+            while self.peek() != "}":
+                key = self.parse_value()
+                self.take() # :
+                result[key] = self.parse_value()
+                if self.peek() == ",":
+                    self.take()
+            self.take()
+            return result
+        raise ValueError("Unexpected token {}".format(token.group(0)))
+
+    def to_json(self, value):
+        if isinstance(value, Event):
+            return value.to_json()
+        if isinstance(value, list):
+            return [self.to_json(item) for item in value]
+        if isinstance(value, dict):
+            return {key: self.to_json(item) for key, item in value.items()}
+        return value
+
+class ServerStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.cpu_time = 0.0
+
+    def add(self, bytes_received : int, bytes_sent : int, cpu_time : float):
+        with self.lock:
+            self.requests += 1
+            self.bytes_received += bytes_received
+            self.bytes_sent += bytes_sent
+            self.cpu_time += cpu_time
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent, "cpu_time": self.cpu_time}
+
+class FakeAwRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, without this delayed acks add ~40ms per request
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, value, bytes_received : int, cpu_begin : float):
+        content = json.dumps(value).encode()
+        self.server.stats.add(bytes_received, len(content), time.thread_time() - cpu_begin)
+        if self.server.delay > 0:
+            time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        cpu_begin = time.thread_time()
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        parts = [part for part in url.path.split("/") if part]
+
+        if parts == ["api", "0", "buckets"]:
+            return self.send_json({bucket_id: bucket.to_json() for bucket_id, bucket in self.server.buckets.items()}, 0, cpu_begin)
+
+        if len(parts) == 5 and parts[:3] == ["api", "0", "buckets"] and parts[4] == "events" and parts[3] in self.server.buckets:
+            bucket = self.server.buckets[parts[3]]
+            begin = parse_timestamp(params["start"][0]) if "start" in params else float("-inf")
+            end = parse_timestamp(params["end"][0]) if "end" in params else float("inf")
+            # The events api returns whole events, newest first
+            events = [event for event in bucket.events if event.end >= begin and event.begin <= end]
+            limit = int(params.get("limit", ["-1"])[0])
+            events = events[::-1] if limit < 0 else events[::-1][:limit]
+            return self.send_json([event.to_json() for event in events], 0, cpu_begin)
+
+        self.send_error(404)
+
+    def do_POST(self):
+        cpu_begin = time.thread_time()
+        content = self.rfile.read(int(self.headers["Content-Length"]))
+        if urlsplit(self.path).path.rstrip("/") != "/api/0/query":
+            return self.send_error(404)
+
+        body = json.loads(content)
+        results = []
+        for timeperiod in body["timeperiods"]:
+            begin, end = [parse_timestamp(timestamp) for timestamp in timeperiod.split("/")]
+            results.append(QueryInterpreter(self.server.buckets, begin, end).run(body["query"]))
+        self.send_json(results, len(content), cpu_begin)
+
+class FakeAwServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, buckets : dict = None, host : str = "127.0.0.1", port : int = 0, delay : float = 0):
+        super().__init__((host, port), FakeAwRequestHandler)
+        self.buckets = generate_buckets() if buckets is None else buckets
+        # Added to every response, to stand in for a slow server
+        self.delay = delay
+        self.stats = ServerStats()
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5600
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 31
+    server = FakeAwServer(buckets=generate_buckets(days=days), port=port)
+    print("Fake aw-server listening on {}".format(server.url))
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import threading
+from bisect import bisect_left, bisect_right
+
+from goaltracker.categorize import merge_intervals
+from goaltracker import localengine
+
+class AfkIntervalCache:
+    # Sorted, merged not-afk intervals of one afk bucket shared by every goal.
+    # New intervals mostly arrive at the end, so extending only touches the tail,
+    # and the covered time of any range is two binary searches on prefix sums.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bucket_id = None
+        self.begins = []
+        self.ends = []
+        # covered_before[i] is the not-afk time before interval i
+        self.covered_before = [0.0]
+        self.revision = 0
+        self.arrays = None
+
+    def is_loaded(self, bucket_id : str) -> bool:
+        return not self.bucket_id is None and self.bucket_id == bucket_id
+
+    def load(self, bucket_id : str, intervals : list):
+        with self.lock:
+            self.bucket_id = bucket_id
+            self.begins, self.ends, self.covered_before = [], [], [0.0]
+            self.replace_tail(0, merge_intervals(intervals))
+
+    def extend(self, intervals : list):
+        if len(intervals) == 0:
+            return
+        with self.lock:
+            # Everything ending before the earliest new interval stays as it is
+            first = bisect_left(self.ends, min(begin for begin, _ in intervals))
+            tail = list(zip(self.begins[first:], self.ends[first:]))
+            self.replace_tail(first, merge_intervals(tail + list(intervals)))
+
+    def replace_tail(self, first : int, merged : list):
+        del self.begins[first:], self.ends[first:], self.covered_before[first + 1:]
+        for begin, end in merged:
+            self.begins.append(begin)
+            self.ends.append(end)
+            self.covered_before.append(self.covered_before[-1] + end - begin)
+        self.revision += 1
+
+    def get_covered_until(self, time : float) -> float:
+        index = bisect_right(self.begins, time) - 1
+        if index < 0:
+            return 0.0
+        return self.covered_before[index] + min(time, self.ends[index]) - self.begins[index]
+
+    def get_covered(self, begin : float, end : float) -> float:
+        # Not-afk seconds inside [begin, end)
+        with self.lock:
+            return self.get_covered_until(end) - self.get_covered_until(begin)
+
+    def get_periods(self, begin : float, end : float) -> list:
+        # The intervals overlapping [begin, end), clipped to it
+        with self.lock:
+            first = bisect_right(self.ends, begin)
+            last = bisect_left(self.begins, end)
+            return [(max(self.begins[i], begin), min(self.ends[i], end)) for i in range(first, last)]
+
+    def get_arrays(self):
+        # (begins, ends, covered_before) as numpy arrays, rebuilt only after the intervals changed
+        with self.lock:
+            if self.arrays is None or self.arrays[0] != self.revision:
+                np = localengine.np
+                self.arrays = (self.revision, np.array(self.begins, dtype=np.float64), np.array(self.ends, dtype=np.float64),
+                    np.array(self.covered_before, dtype=np.float64))
+            return self.arrays[1:]
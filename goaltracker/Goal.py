@@ -10,8 +10,16 @@ class GoalTypes:
     YEARLY = "yearly"
 
 class Goal:
+    # Fixed attributes keep hundreds of goals small. Target and progress are mirrored
+    # into the arrays of a GoalRegistry while the goal is registered with one.
+    __slots__ = ("name", "_target", "_current_progress", "goal_type", "goal_id", "begin_date", "end_date", "active",
+        "filter_afk", "hostname", "server_urls", "registry", "registry_index")
+
     def __init__(self, goal_id = None, name = "", target = 1, current_progress = 0, 
-            goal_type = GoalTypes.DAILY, active = True, begin_date : datetime = None, end_date : datetime = None, filter_afk=False, dict_values : dict = None):
+            goal_type = GoalTypes.DAILY, active = True, begin_date : datetime = None, end_date : datetime = None, filter_afk=False,
+            hostname : str = None, server_urls : list = None, dict_values : dict = None):
+        self.registry = None
+        self.registry_index = None
         self.name = name
         self.target = target
         self.current_progress = current_progress
@@ -22,10 +30,34 @@ class Goal:
         self.end_date = end_date
         self.active = active
         self.filter_afk = filter_afk
+        # Host whose activity watch buckets are counted, None for this machine
+        self.hostname = hostname
+        # aw-server urls whose activity is added up, None for the configured servers
+        self.server_urls = server_urls
 
         if not dict_values is None:
             self.from_dict(dict_values)
     
+    @property
+    def target(self):
+        return self._target
+
+    @target.setter
+    def target(self, target):
+        self._target = target
+        if not self.registry is None:
+            self.registry.set_target(self.registry_index, target)
+
+    @property
+    def current_progress(self):
+        return self._current_progress
+
+    @current_progress.setter
+    def current_progress(self, current_progress):
+        self._current_progress = current_progress
+        if not self.registry is None:
+            self.registry.set_progress(self.registry_index, current_progress)
+
     @staticmethod
     def datetime2unixtimestamp(date : datetime):
         if date is None:
@@ -69,6 +101,8 @@ class Goal:
         self.end_date = dict_values["end_date"]
         self.active = dict_values["active"]
         self.filter_afk = dict_values["filter_afk"]
+        self.hostname = dict_values.get("hostname")
+        self.server_urls = dict_values.get("server_urls")
 
     def to_dict(self):
         return {
@@ -80,5 +114,7 @@ class Goal:
             "begin_date" : self.begin_date,
             "end_date" : self.end_date,
             "active": self.active,
-            "filter_afk": self.filter_afk
+            "filter_afk": self.filter_afk,
+            "hostname": self.hostname,
+            "server_urls": self.server_urls
         }
\ No newline at end of file
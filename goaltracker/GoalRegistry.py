@@ -0,0 +1,144 @@
+import math
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from goaltracker.Goal import Goal, GoalTypes
+
+class GoalRegistry:
+    # Targets, progress and period bounds of every registered goal in contiguous columns,
+    # so percentage, pace and completion of all goals are computed in one pass.
+    # Columns are numpy arrays when numpy is installed, plain double arrays otherwise.
+    def __init__(self, capacity : int = 16):
+        self.goals = []
+        self.columns = {}
+        for name in ("targets", "progress", "period_begins", "period_ends"):
+            self.columns[name] = np.zeros(capacity, dtype=np.float64) if not np is None else array("d")
+
+    def __len__(self):
+        return len(self.goals)
+
+    def get_column(self, name : str):
+        # The filled part of a column, a view when numpy is used
+        column = self.columns[name]
+        return column[:len(self.goals)] if not np is None else column
+
+    def add(self, goal : Goal) -> int:
+        if not goal.registry is None:
+            goal.registry.remove(goal)
+
+        index = len(self.goals)
+        values = {"targets": goal.target, "progress": goal.current_progress, "period_begins": math.nan, "period_ends": math.nan}
+        if not np is None and index >= len(self.columns["targets"]):
+            for name, column in self.columns.items():
+                self.columns[name] = np.concatenate([column, np.zeros(max(16, len(column)), dtype=np.float64)])
+        for name, value in values.items():
+            if np is None:
+                self.columns[name].append(value)
+            else:
+                self.columns[name][index] = value
+
+        self.goals.append(goal)
+        goal.registry = self
+        goal.registry_index = index
+        return index
+
+    def remove(self, goal : Goal):
+        # The last goal moves into the freed slot so the columns stay contiguous
+        if not goal.registry is self:
+            return
+        index, last = goal.registry_index, len(self.goals) - 1
+        moved = self.goals[last]
+        for column in self.columns.values():
+            column[index] = column[last]
+            if np is None:
+                column.pop()
+        self.goals[index] = moved
+        moved.registry_index = index
+        self.goals.pop()
+        goal.registry = None
+        goal.registry_index = None
+
+    def set_target(self, index : int, target : float):
+        self.columns["targets"][index] = target
+
+    def set_progress(self, index : int, current_progress : float):
+        self.columns["progress"][index] = current_progress
+
+    def invalidate_period(self, goal : Goal):
+        # Goal type or dates were edited, the period is read again on the next pass
+        if goal.registry is self:
+            self.columns["period_ends"][goal.registry_index] = math.nan
+
+    def update_periods(self, now : float):
+        # Period bounds only change at rollover or when edited, only those goals are asked again
+        period_begins, period_ends = self.columns["period_begins"], self.columns["period_ends"]
+        for index, goal in enumerate(self.goals):
+            period_end = period_ends[index]
+            if not math.isnan(period_end) and (period_end > now or goal.goal_type == GoalTypes.CUSTOM):
+                continue
+            begin_date, end_date = goal.get_date_range()
+            if begin_date is None or end_date is None:
+                period_begins[index], period_ends[index] = math.nan, math.nan
+            else:
+                period_begins[index], period_ends[index] = begin_date.timestamp(), end_date.timestamp()
+
+    def get_percentages(self):
+        # Progress in percent of the target, 0 for goals without a positive target
+        targets, progress = self.get_column("targets"), self.get_column("progress")
+        if np is None:
+            return array("d", (current * 100 / target if target > 0 else 0.0 for target, current in zip(targets, progress)))
+        percentages = np.zeros(len(self.goals), dtype=np.float64)
+        np.divide(progress * 100, targets, out=percentages, where=targets > 0)
+        return percentages
+
+    def get_completed(self) -> list:
+        targets, progress = self.get_column("targets"), self.get_column("progress")
+        if np is None:
+            return [target > 0 and current >= target for target, current in zip(targets, progress)]
+        return ((targets > 0) & (progress >= targets)).tolist()
+
+    def get_paces(self, now : float = None):
+        # Progress relative to an even spread of the target over the goal period, 1 is on track.
+        # NaN when the period is unknown or has not started yet.
+        if now is None:
+            now = time.time()
+        self.update_periods(now)
+        targets, progress = self.get_column("targets"), self.get_column("progress")
+        period_begins, period_ends = self.get_column("period_begins"), self.get_column("period_ends")
+        if np is None:
+            paces = array("d")
+            for target, current, begin, end in zip(targets, progress, period_begins, period_ends):
+                expected = target * min(max((now - begin) / (end - begin), 0.0), 1.0) if end > begin else math.nan
+                paces.append(current / expected if expected > 0 else math.nan)
+            return paces
+
+        lengths = period_ends - period_begins
+        elapsed = np.full(len(self.goals), np.nan, dtype=np.float64)
+        np.divide(now - period_begins, lengths, out=elapsed, where=lengths > 0)
+        expected = targets * np.clip(elapsed, 0.0, 1.0)
+        paces = np.full(len(self.goals), np.nan, dtype=np.float64)
+        np.divide(progress, expected, out=paces, where=expected > 0)
+        return paces
+
+def main():
+    registry = GoalRegistry()
+    goals = [Goal(goal_id=i, name="goal {}".format(i), target=1 + i % 8, current_progress=i % 5) for i in range(1000)]
+    for goal in goals:
+        registry.add(goal)
+    registry.remove(goals[0])
+    goals[1].current_progress = 10
+
+    begin = time.perf_counter()
+    percentages, paces, completed = registry.get_percentages(), registry.get_paces(), registry.get_completed()
+    print("{} goals in {:.2f} ms".format(len(registry), (time.perf_counter() - begin) * 1000))
+    for goal in registry.goals[:3]:
+        index = goal.registry_index
+        print(goal.name, percentages[index], paces[index], completed[index])
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,60 @@
 import sqlite3
-import os, json
+import os, sys, json
+from datetime import datetime
+from typing import NamedTuple
 from goaltracker.Goal import Goal
+from goaltracker import metrics
+
+# A history sample is only recorded when progress moved at least this much
+PROGRESS_HISTORY_THRESHOLD = 0.05 # hours
+
+class MetricsConnection(sqlite3.Connection):
+    # Times explicit commits and the ones done when leaving a "with con:" block
+    def commit(self):
+        with metrics.timed("db.commit_seconds"):
+            super().commit()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with metrics.timed("db.commit_seconds"):
+            return super().__exit__(exc_type, exc_value, traceback)
+
+class HistoryResolution:
+    MINUTE = 0
+    HOUR = 1
+    DAY = 2
+
+# Samples older than the age are downsampled to the next resolution
+HISTORY_RETENTION = [
+    (HistoryResolution.MINUTE, HistoryResolution.HOUR, 24 * 60 * 60, 60 * 60),
+    (HistoryResolution.HOUR, HistoryResolution.DAY, 30 * 24 * 60 * 60, 24 * 60 * 60),
+]
+
+class ActiveGoal(NamedTuple):
+    goal : Goal
+    filter : dict
 
 class GoalTrackerDb:
     def __init__(self, force_init = False):
         self.con = self.init_db(force_init=force_init)
+        # goal_id -> progress written to Goal.last_progress and to the history
+        self.last_written_progress = {}
+        self.last_history_progress = {}
+
+    @staticmethod
+    def server_urls2json(server_urls : list):
+        # Stored as a json list, NULL when the goal uses the configured servers
+        if not server_urls:
+            return None
+        return json.dumps(list(server_urls))
 
     def add_goal(self, goal : Goal):
         cur = self.con.cursor()
         inserted_goal = cur.execute(
-            "INSERT INTO Goal (name, target, last_progress, type, active, begin_date, end_date, filter_afk, creation_date)"
-            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, unixepoch())",
+            "INSERT INTO Goal (name, target, last_progress, type, active, begin_date, end_date, filter_afk, hostname, server_urls, creation_date)"
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, unixepoch())",
             (goal.name, goal.target, goal.current_progress, goal.goal_type, goal.active, 
-            Goal.datetime2unixtimestamp(goal.begin_date), Goal.datetime2unixtimestamp(goal.end_date), goal.filter_afk)
+            Goal.datetime2unixtimestamp(goal.begin_date), Goal.datetime2unixtimestamp(goal.end_date), goal.filter_afk, goal.hostname,
+            GoalTrackerDb.server_urls2json(goal.server_urls))
         )
         self.con.commit()
 
@@ -50,6 +92,7 @@ class GoalTrackerDb:
             self.con.commit()
     
     def update_goal_progress(self, goal_id : int, current_progress):
+        self.last_written_progress[goal_id] = current_progress
         cur = self.con.cursor()
         cur.execute(
                 "UPDATE Goal "
@@ -59,6 +102,82 @@ class GoalTrackerDb:
             )
         self.con.commit()
 
+    def update_goals_progress(self, goals_progress : list):
+        # goals_progress is a list of (goal_id, current_progress), only changed values are written
+        # and history samples are added in the same transaction.
+        changed = [(goal_id, current_progress) for goal_id, current_progress in goals_progress
+            if self.last_written_progress.get(goal_id) != current_progress]
+        if len(changed) < 1:
+            return
+
+        samples = []
+        for goal_id, current_progress in changed:
+            if not goal_id in self.last_history_progress:
+                self.last_history_progress[goal_id] = self.get_last_history_progress(goal_id)
+            last_progress = self.last_history_progress[goal_id]
+            if last_progress is None or abs(current_progress - last_progress) >= PROGRESS_HISTORY_THRESHOLD:
+                samples.append((goal_id, current_progress))
+
+        with self.con:
+            self.con.executemany(
+                    "UPDATE Goal "
+                    "SET last_progress = (?) "
+                    "WHERE id = (?)",
+                    [(current_progress, goal_id) for goal_id, current_progress in changed]
+                )
+            self.con.executemany(
+                    "INSERT INTO GoalProgressHistory(goal_id, timestamp, progress, resolution) "
+                    "VALUES (?, unixepoch(), ?, ?)",
+                    [(goal_id, current_progress, HistoryResolution.MINUTE) for goal_id, current_progress in samples]
+                )
+
+        for goal_id, current_progress in changed:
+            self.last_written_progress[goal_id] = current_progress
+        for goal_id, current_progress in samples:
+            self.last_history_progress[goal_id] = current_progress
+
+    def get_last_history_progress(self, goal_id : int):
+        cur = self.con.cursor()
+        row = cur.execute(
+            "select progress from GoalProgressHistory "
+            "where goal_id = (?) "
+            "order by timestamp desc, rowid desc limit 1",
+            (goal_id, )
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def get_progress_history(self, goal_id : int, begin_date : datetime, end_date : datetime):
+        cur = self.con.cursor()
+        history = cur.execute(
+            "select timestamp, progress from GoalProgressHistory "
+            "where goal_id = (?) and timestamp >= (?) and timestamp <= (?) "
+            "order by timestamp",
+            (goal_id, Goal.datetime2unixtimestamp(begin_date), Goal.datetime2unixtimestamp(end_date))
+        )
+        return history.fetchall()
+
+    def downsample_progress_history(self):
+        # Keeps the latest sample of every hour for samples older than a day and
+        # the latest sample of every day for samples older than a month. Samples already
+        # downsampled by an earlier run are grouped with the new ones, so every bucket
+        # keeps a single sample.
+        with self.con:
+            for resolution, next_resolution, max_age, bucket_size in HISTORY_RETENTION:
+                self.con.execute(
+                    "DELETE FROM GoalProgressHistory "
+                    "WHERE ((resolution = (?) and timestamp < unixepoch() - (?)) or resolution = (?)) and rowid not in ("
+                        "select max(rowid) from GoalProgressHistory "
+                        "where (resolution = (?) and timestamp < unixepoch() - (?)) or resolution = (?) "
+                        "group by goal_id, timestamp / (?)"
+                    ")",
+                    (resolution, max_age, next_resolution, resolution, max_age, next_resolution, bucket_size)
+                )
+                self.con.execute(
+                    "UPDATE GoalProgressHistory SET resolution = (?) "
+                    "WHERE resolution = (?) and timestamp < unixepoch() - (?)",
+                    (next_resolution, resolution, max_age)
+                )
+
     def update_goal_filter_afk(self, goal_id : int, filter_afk: bool):
         cur = self.con.cursor()
         cur.execute(
@@ -76,10 +195,12 @@ class GoalTrackerDb:
         if len(registered_goal) > 0:
             cur.execute(
                 "UPDATE Goal "
-                "SET name = (?), target = (?), last_progress = (?), type = (?), active = (?), begin_date = (?), end_date = (?), filter_afk = (?) "
+                "SET name = (?), target = (?), last_progress = (?), type = (?), active = (?), begin_date = (?), end_date = (?), filter_afk = (?), "
+                "hostname = (?), server_urls = (?) "
                 "WHERE id = (?)",
                 (goal.name, goal.target, goal.current_progress, goal.goal_type, goal.active,
-                Goal.datetime2unixtimestamp(goal.begin_date), Goal.datetime2unixtimestamp(goal.end_date), goal.filter_afk, goal.goal_id)
+                Goal.datetime2unixtimestamp(goal.begin_date), Goal.datetime2unixtimestamp(goal.end_date), goal.filter_afk, goal.hostname,
+                GoalTrackerDb.server_urls2json(goal.server_urls), goal.goal_id)
             )
             self.con.commit()
         else:
@@ -106,6 +227,72 @@ class GoalTrackerDb:
             )
         self.con.commit()
 
+    def get_daily_progress(self, goal_id : int, fingerprint : str):
+        cur = self.con.cursor()
+        daily_progress = cur.execute(
+            "select timeperiod, progress from GoalDailyProgress "
+            "where goal_id = (?) and fingerprint = (?)",
+            (goal_id, fingerprint)
+        )
+        return daily_progress.fetchall()
+
+    def add_daily_progress(self, goal_id : int, fingerprint : str, daily_progress : dict):
+        # daily_progress maps "begin/end" iso time periods to the progress of that period
+        with self.con:
+            self.con.executemany(
+                "INSERT OR REPLACE INTO GoalDailyProgress(goal_id, fingerprint, timeperiod, begin_date, progress) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(goal_id, fingerprint, timeperiod, Goal.datetime2unixtimestamp(datetime.fromisoformat(timeperiod.split("/")[0])), progress)
+                    for timeperiod, progress in daily_progress.items()]
+            )
+
+    def delete_stale_daily_progress(self, goal_id : int, fingerprint : str):
+        # Rows of older filter configurations can not be reused anymore
+        cur = self.con.cursor()
+        cur.execute(
+            "DELETE FROM GoalDailyProgress "
+            "WHERE goal_id = (?) and fingerprint != (?)",
+            (goal_id, fingerprint)
+        )
+        self.con.commit()
+
+    def load_active_goals_with_filters(self) -> list:
+        # Goals and their filters in a single query
+        cur = self.con.cursor()
+        rows = cur.execute(
+            "select Goal.id, Goal.name, Goal.target, Goal.last_progress, Goal.type, Goal.active, "
+            "Goal.begin_date, Goal.end_date, Goal.filter_afk, Goal.hostname, Goal.server_urls, ActivityWatchFilter.filter "
+            "from Goal left join ActivityWatchFilter on ActivityWatchFilter.goal_id = Goal.id "
+            "where Goal.active = 1 "
+            "order by Goal.id"
+        )
+
+        active_goals = []
+        for goal_id, name, target, last_progress, goal_type, active, begin_date, end_date, filter_afk, hostname, server_urls, goal_filter in rows:
+            # Convert unix timestamp to python datetime
+            goal = Goal(goal_id=goal_id, name=name, target=target, current_progress=last_progress, goal_type=goal_type,
+                active=bool(active), begin_date=datetime.fromtimestamp(begin_date) if begin_date else None,
+                end_date=datetime.fromtimestamp(end_date) if end_date else None, filter_afk=bool(filter_afk), hostname=hostname,
+                server_urls=None if server_urls is None else json.loads(server_urls))
+            active_goals.append(ActiveGoal(goal, None if goal_filter is None else json.loads(goal_filter)))
+        return active_goals
+
+    def update_goal_filter_settings(self, goal_id : int, activity_watch_filter : dict, filter_afk : bool):
+        # Filter and afk flag are written in one transaction
+        with self.con:
+            self.con.execute(
+                "UPDATE Goal "
+                "SET filter_afk = (?) "
+                "WHERE id = (?)",
+                (filter_afk, goal_id)
+            )
+            self.con.execute(
+                "INSERT INTO ActivityWatchFilter(goal_id, filter) "
+                "VALUES(?, ?) "
+                "ON CONFLICT(goal_id) DO UPDATE SET filter = excluded.filter",
+                (goal_id, json.dumps(activity_watch_filter))
+            )
+
     def get_goals(self):
         cur = self.con.cursor()
         goals = cur.execute(
@@ -114,6 +301,18 @@ class GoalTrackerDb:
         )
         return goals.fetchall()
     
+    def get_setting(self, key : str):
+        row = self.con.execute("select value from Setting where key = (?)", (key, )).fetchone()
+        return None if row is None else row[0]
+
+    def set_setting(self, key : str, value : str):
+        # None removes the setting
+        if value is None:
+            self.con.execute("DELETE FROM Setting WHERE key = (?)", (key, ))
+        else:
+            self.con.execute("INSERT OR REPLACE INTO Setting(key, value) VALUES (?, ?)", (key, value))
+        self.con.commit()
+
     def get_goal_types(self):
         cur = self.con.cursor()
         goalType = cur.execute("select * from GoalType")
@@ -131,13 +330,16 @@ class GoalTrackerDb:
 
         # If already exist, just return it
         if not force_init and os.path.exists(db_path):
-            return sqlite3.connect(db_path)
+            con = self.connect(db_path)
+            self.migrate_db(con)
+            return con
         
-        if os.path.exists(db_path):
-            os.remove(db_path)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
 
         # Create db and initialize
-        con = sqlite3.connect(db_path)
+        con = self.connect(db_path)
 
         cur = con.cursor()
         
@@ -153,7 +355,8 @@ class GoalTrackerDb:
         cur.execute("INSERT INTO GoalType(type) VALUES ('custom')")
 
         goalType = cur.execute("select * from GoalType")
-        print("Registered goal types:", goalType.fetchall())
+        # stderr, stdout of the report commands is read by scripts
+        print("Registered goal types:", goalType.fetchall(), file=sys.stderr)
 
         cur.execute(
             "CREATE TABLE Goal("
@@ -190,8 +393,60 @@ class GoalTrackerDb:
         )
 
         con.commit()
+        self.migrate_db(con)
+        return con
+
+    def connect(self, db_path : str) -> sqlite3.Connection:
+        # Statements are kept prepared in the connection statement cache
+        con = sqlite3.connect(db_path, cached_statements=256, factory=MetricsConnection)
+        con.execute("PRAGMA journal_mode = WAL")
+        # WAL keeps the db consistent with NORMAL, only the last commits may be lost on power loss
+        con.execute("PRAGMA synchronous = NORMAL")
+        con.execute("PRAGMA temp_store = MEMORY")
+        con.execute("PRAGMA cache_size = -8000") # 8 MB
         return con
 
+    def migrate_db(self, con : sqlite3.Connection):
+        # Tables added after the first release, created for new and existing dbs
+        cur = con.cursor()
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS GoalDailyProgress("
+                "goal_id INTEGER NOT NULL,"
+                "fingerprint VARCHAR NOT NULL,"
+                "timeperiod VARCHAR NOT NULL,"
+                "begin_date INTEGER NOT NULL,"
+                "progress REAL NOT NULL DEFAULT (0),"
+                "PRIMARY KEY(goal_id, fingerprint, timeperiod),"
+                "FOREIGN KEY(goal_id) REFERENCES Goal(id)"
+            ")"
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS GoalActive ON Goal(active)")
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS GoalProgressHistory("
+                "goal_id INTEGER NOT NULL,"
+                "timestamp INTEGER NOT NULL,"
+                "progress REAL NOT NULL,"
+                "resolution INTEGER NOT NULL DEFAULT (0),"
+                "FOREIGN KEY(goal_id) REFERENCES Goal(id)"
+            ")"
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS GoalProgressHistoryTime ON GoalProgressHistory(goal_id, timestamp)")
+        # Settings the headless report needs as well, it can not read the Qt settings
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS Setting("
+                "key VARCHAR PRIMARY KEY NOT NULL,"
+                "value VARCHAR"
+            ")"
+        )
+
+        # Columns added after the first release
+        goal_columns = [row[1] for row in cur.execute("PRAGMA table_info(Goal)")]
+        if "hostname" not in goal_columns:
+            cur.execute("ALTER TABLE Goal ADD COLUMN hostname VARCHAR")
+        if "server_urls" not in goal_columns:
+            cur.execute("ALTER TABLE Goal ADD COLUMN server_urls VARCHAR")
+        con.commit()
+
 def main():
     tracker = GoalTrackerDb("testdb", True)
     goal_id = tracker.add_goal(Goal(name = "work", target = 120, current_progress=1))
@@ -0,0 +1,150 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from goaltracker.awfetcher import fetch_chunked_group_hours
+from goaltracker.GoalTrackerDb import GoalTrackerDb
+
+# A day is only considered closed after this margin, afk watcher reports
+# status changes a few minutes late and may still alter the last events of the day.
+CLOSE_SETTLE_TIME = timedelta(minutes=5)
+
+class ProgressAccumulator:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # goal key -> [fingerprint, {timeperiod: hours}]
+        self.closed_periods = {}
+        # Closed periods fetched since the last call to take_new_closed_hours
+        self.new_closed_periods = []
+
+    @staticmethod
+    def split_date_range(begin_date : datetime, end_date : datetime, now : datetime = None):
+        # Splits the range into per day periods, returns the closed ones and the still open one
+        if now is None:
+            now = datetime.now(begin_date.tzinfo)
+
+        closed, open_period = [], None
+        period_begin = begin_date
+        while period_begin < end_date and period_begin <= now:
+            next_day = period_begin.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+            period_end = min(next_day, end_date)
+            timeperiod = "{}/{}".format(period_begin.isoformat(), period_end.isoformat())
+            if period_end + CLOSE_SETTLE_TIME <= now:
+                closed.append(timeperiod)
+            else:
+                open_period = timeperiod
+                break
+            period_begin = next_day
+        return closed, open_period
+
+    def has_closed_hours(self, key, fingerprint : str) -> bool:
+        with self.lock:
+            stored = self.closed_periods.get(key)
+            return not stored is None and stored[0] == fingerprint
+
+    def load_closed_hours(self, key, fingerprint : str, hours : dict):
+        with self.lock:
+            self.closed_periods[key] = [fingerprint, dict(hours)]
+
+    def take_new_closed_hours(self) -> list:
+        with self.lock:
+            new_closed_periods = self.new_closed_periods
+            self.new_closed_periods = []
+            return new_closed_periods
+
+    def get_closed_hours(self, key, fingerprint : str) -> dict:
+        with self.lock:
+            stored = self.closed_periods.get(key)
+            # Filter or afk flag changed, stored totals are no longer valid
+            if stored is None or stored[0] != fingerprint:
+                stored = [fingerprint, {}]
+                self.closed_periods[key] = stored
+            return dict(stored[1])
+
+    def store_closed_hours(self, key, fingerprint : str, closed : list, hours : dict):
+        with self.lock:
+            stored = self.closed_periods.get(key)
+            if stored is None or stored[0] != fingerprint:
+                stored = [fingerprint, {}]
+                self.closed_periods[key] = stored
+            new_hours = {timeperiod: hours[timeperiod] for timeperiod in closed
+                if timeperiod in hours and timeperiod not in stored[1]}
+            if len(new_hours) > 0:
+                self.new_closed_periods.append((key, fingerprint, new_hours))
+            # Drop periods that are not part of the goal range anymore
+            stored[1] = {timeperiod: hours[timeperiod] for timeperiod in closed if timeperiod in hours}
+
+    def invalidate(self, key):
+        with self.lock:
+            self.closed_periods.pop(key, None)
+
+    def plan_fetch(self, goal_queries : list):
+        # Goals needing the same periods are grouped into a single query,
+        # once the closed days are known that is only the current day for all of them.
+        groups = {}
+        plans = {}
+        for goal_query in goal_queries:
+            fingerprint = goal_query.get_fingerprint()
+            closed, open_period = self.split_date_range(goal_query.begin_date, goal_query.end_date)
+            known = self.get_closed_hours(goal_query.key, fingerprint)
+
+            needed = [timeperiod for timeperiod in closed if timeperiod not in known]
+            if not open_period is None:
+                needed.append(open_period)
+
+            plans[goal_query.key] = (fingerprint, closed, open_period, known)
+            if len(needed) > 0:
+                groups.setdefault(tuple(needed), []).append(goal_query)
+        return groups, plans
+
+    def complete_fetch(self, goal_queries : list, plans : dict, fetched : dict, partial : dict = None) -> dict:
+        # fetched maps goal keys to {timeperiod: hours} or None when the fetch failed,
+        # hours of goals in partial lack a server and are not kept as closed days
+        results = {}
+        for goal_query in goal_queries:
+            fingerprint, closed, open_period, known = plans[goal_query.key]
+            if goal_query.key in fetched:
+                if fetched[goal_query.key] is None:
+                    results[goal_query.key] = None
+                    continue
+                known.update(fetched[goal_query.key])
+
+            if partial is None or goal_query.key not in partial:
+                self.store_closed_hours(goal_query.key, fingerprint, closed, known)
+            timeperiods = closed if open_period is None else closed + [open_period]
+            results[goal_query.key] = sum(known.get(timeperiod, 0) for timeperiod in timeperiods)
+        return results
+
+    def fetch_hours(self, goal_queries : list, max_workers : int = 1, partial : dict = None) -> dict:
+        groups, plans = self.plan_fetch(goal_queries)
+        groups = list(groups.items())
+
+        # Groups are independent queries, they can be sent in parallel. The missing days
+        # of a long range are chunked and sent in parallel on their own.
+        if max_workers > 1 and len(groups) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(groups))) as executor:
+                group_results = list(executor.map(lambda group: fetch_chunked_group_hours(list(group[0]), group[1], partial=partial), groups))
+        else:
+            group_results = [fetch_chunked_group_hours(list(timeperiods), group, partial=partial) for timeperiods, group in groups]
+
+        fetched = {}
+        for (timeperiods, _), hours_by_key in zip(groups, group_results):
+            for key, hours in hours_by_key.items():
+                fetched[key] = None if hours is None else dict(zip(timeperiods, hours))
+
+        return self.complete_fetch(goal_queries, plans, fetched, partial)
+
+    def load_daily_progress(self, goal_tracker_db : GoalTrackerDb, goal_queries : list):
+        # Closed days stored by previous runs are read before asking activity watch,
+        # the db connection is not shared between threads so this runs on the thread owning it.
+        for goal_query in goal_queries:
+            fingerprint = goal_query.get_fingerprint()
+            if self.has_closed_hours(goal_query.key, fingerprint):
+                continue
+            goal_tracker_db.delete_stale_daily_progress(goal_query.key, fingerprint)
+            daily_progress = goal_tracker_db.get_daily_progress(goal_query.key, fingerprint)
+            self.load_closed_hours(goal_query.key, fingerprint, dict(daily_progress))
+
+    def store_daily_progress(self, goal_tracker_db : GoalTrackerDb):
+        for key, fingerprint, daily_progress in self.take_new_closed_hours():
+            goal_tracker_db.add_daily_progress(key, fingerprint, daily_progress)
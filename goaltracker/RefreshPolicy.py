@@ -0,0 +1,64 @@
+from datetime import datetime
+
+from goaltracker.Goal import Goal
+
+class RefreshPolicy:
+    # Decides how long a goal can wait for its next refresh, all values are in seconds.
+    def __init__(self, base_interval : float = 60, min_interval : float = 15, max_interval : float = 30 * 60,
+            hidden_interval : float = 15 * 60, completed_interval : float = 30 * 60,
+            progress_step : float = 0.01, afk_backoff : float = 2):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.hidden_interval = hidden_interval
+        self.completed_interval = completed_interval
+        # Fraction of the target a refresh should be able to show at most
+        self.progress_step = progress_step
+        self.afk_backoff = afk_backoff
+
+    @staticmethod
+    def is_completed(goal : Goal) -> bool:
+        return goal.target > 0 and goal.current_progress >= goal.target
+
+    @staticmethod
+    def get_seconds_until_rollover(goal : Goal, now : datetime = None):
+        # Time until the goal period ends and a new one starts, None if the period has no end
+        try:
+            _, end_date = goal.get_date_range()
+        except Exception:
+            return None
+        if end_date is None:
+            return None
+        if now is None:
+            now = datetime.now(end_date.tzinfo)
+        seconds = (end_date - now).total_seconds()
+        if seconds < 0:
+            return None
+        # Land just after the last second of the period
+        return seconds + 1
+
+    def get_interval(self, goal : Goal, is_afk : bool = False, is_visible : bool = True, afk_refreshes : int = 0,
+            completed : bool = None) -> float:
+        # completed can be handed in when it was computed for all goals at once
+        if completed is None:
+            completed = self.is_completed(goal)
+        if not is_visible:
+            interval = self.hidden_interval
+        elif completed:
+            interval = self.completed_interval
+        else:
+            # Progress in hours grows at most as fast as the clock, so a refresh every
+            # progress_step of the target is enough, and the goal is polled again right when it could complete.
+            interval = max(self.min_interval, min(self.base_interval, goal.target * 3600 * self.progress_step))
+            remaining = (goal.target - goal.current_progress) * 3600
+            interval = max(self.min_interval, min(interval, remaining))
+
+            if is_afk:
+                # Nothing is tracked while away, back off further with every refresh
+                interval = interval * self.afk_backoff ** (afk_refreshes + 1)
+            interval = min(interval, self.max_interval)
+
+        rollover = self.get_seconds_until_rollover(goal)
+        if not rollover is None:
+            interval = min(interval, rollover)
+        return interval
@@ -1,8 +1,11 @@
-from goaltracker.ui.GoalTrackerMainWindow import GoalTrackerMainWindow
 import sys
-from PyQt5.QtWidgets import QApplication
+import argparse
+
+def run_gui():
+    # Qt is only imported when the widget is actually launched
+    from PyQt5.QtWidgets import QApplication
+    from goaltracker.ui.GoalTrackerMainWindow import GoalTrackerMainWindow
 
-def main():
     app = QApplication(sys.argv)
 
     root_widget = GoalTrackerMainWindow()
@@ -11,8 +14,33 @@ def main():
     #root_widget.resize(300, 300)
 
     app.aboutToQuit.connect(root_widget.save_window_geometry)
+    app.aboutToQuit.connect(root_widget.save_pending_filters)
+    app.aboutToQuit.connect(root_widget.shutdown_fetches)
     # Update progress value for demonstration
     sys.exit(app.exec_())
 
+def run_report(args):
+    from goaltracker.GoalTrackerDb import GoalTrackerDb
+    from goaltracker.report import compute_progress, print_report, print_status
+
+    report = compute_progress(GoalTrackerDb())
+    if args.command == "status":
+        print_status(report, as_json=args.json)
+    else:
+        print_report(report, as_json=args.json)
+
+def main():
+    parser = argparse.ArgumentParser(prog="goaltracker")
+    subparsers = parser.add_subparsers(dest="command")
+    for command, help in (("report", "print the progress of every active goal"), ("status", "print a single line summary")):
+        subparser = subparsers.add_parser(command, help=help)
+        subparser.add_argument("--json", action="store_true", help="print json instead of text")
+    args = parser.parse_args()
+
+    if args.command is None:
+        run_gui()
+    else:
+        run_report(args)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
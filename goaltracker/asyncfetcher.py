@@ -0,0 +1,168 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+from goaltracker.awfetcher import group_by_timeperiod, build_group_request, parse_group_hours, \
+    split_timeperiod, chunk_timeperiods, merge_chunk_hours, resolve_bucket_ids, get_answerable_queries
+from goaltracker.awbuckets import get_bucket_cache
+from goaltracker.awtransport import AW_QUERY_PATH, CONNECT_TIMEOUT, READ_TIMEOUT, get_transport
+from goaltracker.ProgressAccumulator import ProgressAccumulator
+from goaltracker import metrics
+
+class AsyncAwTransport:
+    # Minimal keep-alive HTTP/1.1 client, enough for the aw-server query api
+    def __init__(self, server_url : str = None, connect_timeout : float = CONNECT_TIMEOUT, read_timeout : float = READ_TIMEOUT,
+            max_concurrency : int = 4):
+        if server_url is None:
+            server_url = get_transport().server_url
+        url = urlsplit(server_url)
+        self.server_url = server_url
+        self.host = url.hostname
+        self.use_ssl = url.scheme == "https"
+        self.port = url.port or (443 if self.use_ssl else 80)
+        self.base_path = url.path.rstrip("/")
+
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.idle_connections = []
+
+    async def open_connection(self):
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.use_ssl or None), self.connect_timeout)
+
+    async def post(self, path : str, data : str):
+        metrics.increment("aw.requests")
+        begin = time.perf_counter()
+        try:
+            status, content = await self.post_once(path, data)
+        except Exception:
+            metrics.increment("aw.request_errors")
+            raise
+        metrics.observe("aw.request_seconds", time.perf_counter() - begin)
+        metrics.increment("aw.bytes_received", len(content))
+        if status != 200:
+            metrics.increment("aw.request_errors")
+        return status, content
+
+    async def post_once(self, path : str, data : str):
+        async with self.semaphore:
+            body = data.encode()
+            metrics.increment("aw.bytes_sent", len(body))
+            # A reused connection may have been closed by the server meanwhile, retry once on a new one
+            while len(self.idle_connections) > 0:
+                reader, writer = self.idle_connections.pop()
+                try:
+                    return await self.send(reader, writer, path, body)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    continue
+            reader, writer = await self.open_connection()
+            return await self.send(reader, writer, path, body)
+
+    async def send(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter, path : str, body : bytes):
+        try:
+            writer.write(
+                "POST {} HTTP/1.1\r\n"
+                "Host: {}:{}\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: {}\r\n"
+                "Connection: keep-alive\r\n"
+                "\r\n".format(self.base_path + path, self.host, self.port, len(body)).encode() + body)
+            await writer.drain()
+            status, headers, content = await asyncio.wait_for(self.read_response(reader), self.read_timeout)
+        except BaseException:
+            writer.close()
+            raise
+
+        if headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            self.idle_connections.append((reader, writer))
+        return status, content
+
+    async def read_response(self, reader : asyncio.StreamReader):
+        status_line = await reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, value = line.decode("latin-1").split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+        if status_line.startswith(b"HTTP/1.0") and headers.get("connection", "").lower() != "keep-alive":
+            headers["connection"] = "close"
+
+        if "content-length" in headers:
+            content = await reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            content = b"".join(chunks)
+        else:
+            content = await reader.read()
+            headers["connection"] = "close"
+        return status, headers, content
+
+    def close(self):
+        for _, writer in self.idle_connections:
+            writer.close()
+        self.idle_connections = []
+
+async def fetch_group_hours_async(transport : AsyncAwTransport, timeperiods : list, goal_queries : list) -> dict:
+    # The buckets api is read through the blocking transport, off the event loop
+    if not get_bucket_cache().is_fresh():
+        await asyncio.get_running_loop().run_in_executor(None, get_bucket_cache().refresh)
+    results = {goal_query.key: None for goal_query in goal_queries}
+    bucket_ids = resolve_bucket_ids(goal_queries, cached_only=True)
+    goal_queries = get_answerable_queries(goal_queries, bucket_ids)
+    if len(goal_queries) < 1:
+        return results
+
+    data_json = build_group_request(timeperiods, goal_queries, bucket_ids)
+    try:
+        status, content = await transport.post(AW_QUERY_PATH, data_json)
+        if status == 200:
+            results.update(parse_group_hours(content, timeperiods, goal_queries))
+        else:
+            get_bucket_cache().invalidate()
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        pass
+    return results
+
+async def fetch_chunked_group_hours_async(transport : AsyncAwTransport, timeperiods : list, goal_queries : list) -> dict:
+    # Chunks run concurrently, bounded by the transport semaphore
+    chunks = chunk_timeperiods(timeperiods)
+    chunk_results = await asyncio.gather(*[fetch_group_hours_async(transport, chunk, goal_queries) for chunk in chunks])
+    return merge_chunk_hours(goal_queries, chunk_results)
+
+async def fetch_hours_batch_async(transport : AsyncAwTransport, goal_queries : list) -> dict:
+    groups = list(group_by_timeperiod(goal_queries).items())
+    fetched = await asyncio.gather(*[fetch_chunked_group_hours_async(transport,
+        split_timeperiod(group[0].begin_date, group[0].end_date), group) for _, group in groups])
+
+    results = {}
+    for group_results in fetched:
+        for key, hours in group_results.items():
+            results[key] = None if hours is None else sum(hours)
+    return results
+
+async def fetch_hours_incremental_async(transport : AsyncAwTransport, progress_accumulator : ProgressAccumulator, goal_queries : list) -> dict:
+    groups, plans = progress_accumulator.plan_fetch(goal_queries)
+    groups = list(groups.items())
+    group_results = await asyncio.gather(*[fetch_chunked_group_hours_async(transport, list(timeperiods), group) for timeperiods, group in groups])
+
+    fetched = {}
+    for (timeperiods, _), hours_by_key in zip(groups, group_results):
+        for key, hours in hours_by_key.items():
+            fetched[key] = None if hours is None else dict(zip(timeperiods, hours))
+    return progress_accumulator.complete_fetch(goal_queries, plans, fetched)
@@ -0,0 +1,93 @@
+import socket
+import threading
+import time
+
+from goaltracker.awtransport import get_transport, get_server_transport
+
+WINDOW_BUCKET_TYPE = "currentwindow"
+AFK_BUCKET_TYPE = "afkstatus"
+
+BUCKET_CACHE_TTL = 10 * 60 # seconds, new watchers are picked up after this at the latest
+
+class BucketCache:
+    # Bucket ids and their hosts as reported by the buckets api, read once and kept
+    # until they get old, the server changes or a query using them fails.
+    def __init__(self, ttl : float = BUCKET_CACHE_TTL, transport_url : str = None):
+        self.lock = threading.Lock()
+        self.ttl = ttl
+        # None follows the main server
+        self.transport_url = transport_url
+        self.server_url = None
+        self.buckets = None
+        self.fetched_at = 0
+
+    def get_transport(self):
+        return get_transport() if self.transport_url is None else get_server_transport(self.transport_url)
+
+    def is_fresh(self) -> bool:
+        return not self.buckets is None and self.server_url == self.get_transport().server_url \
+            and time.monotonic() - self.fetched_at < self.ttl
+
+    def refresh(self, transport = None) -> bool:
+        if transport is None:
+            transport = self.get_transport()
+        try:
+            response = transport.get("/api/0/buckets/")
+            if response.status_code != 200:
+                return False
+            buckets = {bucket_id: {"type": bucket.get("type"), "hostname": bucket.get("hostname")}
+                for bucket_id, bucket in response.json().items()}
+        except Exception:
+            return False
+
+        with self.lock:
+            self.server_url = transport.server_url
+            self.buckets = buckets
+            self.fetched_at = time.monotonic()
+        return True
+
+    def invalidate(self):
+        with self.lock:
+            self.buckets = None
+
+    def get_buckets(self, cached_only : bool = False) -> dict:
+        # bucket id -> {"type", "hostname"}, None if aw-server could not be reached
+        if not cached_only and not self.is_fresh():
+            self.refresh()
+        with self.lock:
+            return None if self.buckets is None else dict(self.buckets)
+
+    def get_hostnames(self, cached_only : bool = False) -> list:
+        buckets = self.get_buckets(cached_only)
+        if buckets is None:
+            return []
+        return sorted(set(bucket["hostname"] for bucket in buckets.values() if bucket["hostname"]))
+
+    def find_bucket_id(self, bucket_type : str, hostname : str = None):
+        # Without a hostname the buckets of this machine are preferred, then the first one by id
+        buckets = self.get_buckets()
+        if buckets is None:
+            return None
+        candidates = sorted(bucket_id for bucket_id, bucket in buckets.items() if bucket["type"] == bucket_type
+            and (hostname is None or bucket["hostname"] == hostname))
+        if len(candidates) < 1:
+            return None
+        if hostname is None:
+            local_hostname = socket.gethostname()
+            for bucket_id in candidates:
+                if buckets[bucket_id]["hostname"] == local_hostname:
+                    return bucket_id
+        return candidates[0]
+
+_bucket_cache = BucketCache()
+_server_bucket_caches = {}
+_server_bucket_caches_lock = threading.Lock()
+
+def get_bucket_cache(server_url : str = None) -> BucketCache:
+    if server_url is None or server_url.rstrip("/") == get_transport().server_url:
+        return _bucket_cache
+    with _server_bucket_caches_lock:
+        server_url = server_url.rstrip("/")
+        if server_url not in _server_bucket_caches:
+            _server_bucket_caches[server_url] = BucketCache(transport_url=server_url)
+        return _server_bucket_caches[server_url]
@@ -1,57 +1,390 @@
-
 import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timezone, timedelta
-import requests
 
-AW_QUERY_URL = "http://localhost:5600/api/0/query/"
+from goaltracker.awtransport import get_transport, get_server_transport, get_server_urls
+from goaltracker import metrics
+from goaltracker.categorize import UNCATEGORIZED, merge_intervals
+from goaltracker.jsonstream import iter_json_values
+from goaltracker.awbuckets import get_bucket_cache, WINDOW_BUCKET_TYPE, AFK_BUCKET_TYPE
+
+# Ranges longer than a day are split into day periods and sent as several requests
+# of at most CHUNK_PERIODS periods, at most MAX_FETCH_WORKERS of them at once.
+CHUNK_PERIODS = 14
+MAX_FETCH_WORKERS = 4
+
+# Goals counted on several servers ask all of them at once, servers that did not answer
+# within SERVER_WAIT_TIMEOUT are left out and the goal is reported as partial.
+MAX_SERVER_WORKERS = 8
+SERVER_WAIT_TIMEOUT = 20 # seconds
+
+# Added to the fingerprint of default host goals, an object so it cannot collide with a hostname
+DEFAULT_HOST_BUCKETS = {"buckets": "this-host"}
+
+class GoalQuery:
+    def __init__(self, key, filters : list, begin_date : datetime, end_date : datetime, filter_afk : bool,
+            filters_json : str = None, fingerprint : str = None, hostname : str = None, server_urls : list = None):
+        self.key = key
+        self.filters = filters
+        self.begin_date = begin_date
+        self.end_date = end_date
+        self.filter_afk = filter_afk
+        # Host whose buckets are counted, None for the default host
+        self.hostname = hostname
+        # aw-server urls the goal is counted on, None for the global list
+        self.server_urls = server_urls
+
+        # Serialized filter and fingerprint can be handed in when the caller already has them cached
+        self.filters_json = filters_json
+        self.fingerprint = fingerprint
+
+    def get_filters_json(self):
+        if self.filters_json is None:
+            self.filters_json = json.dumps(self.filters, sort_keys=True)
+        return self.filters_json
+
+    def get_timeperiod(self):
+        return "{}/{}".format(self.begin_date.isoformat(), self.end_date.isoformat())
+
+    def get_server_urls(self) -> tuple:
+        if self.server_urls:
+            return tuple(url.rstrip("/") for url in self.server_urls)
+        return tuple(get_server_urls())
+
+    def get_fingerprint(self):
+        if self.fingerprint is None:
+            self.fingerprint = filter_fingerprint(self.filters, self.filter_afk, self.begin_date.utcoffset(), self.get_filters_json(),
+                self.hostname, self.get_server_urls())
+        return self.fingerprint
 
 
 def fetch_hours(filters : list, begin_date : datetime, end_date : datetime, filter_afk : bool):
+    return fetch_hours_batch([GoalQuery(0, filters, begin_date, end_date, filter_afk)])[0]
+
+def resolve_bucket_ids(goal_queries : list, cached_only : bool = False, server_url : str = None) -> dict:
+    # hostname -> (window bucket id, afk bucket id) of every host used by the goals,
+    # ids are None when the buckets api could not tell
+    bucket_cache = get_bucket_cache(server_url)
+    if cached_only and not bucket_cache.is_fresh():
+        return {}
+    bucket_ids = {}
+    for goal_query in goal_queries:
+        if goal_query.hostname not in bucket_ids:
+            bucket_ids[goal_query.hostname] = (bucket_cache.find_bucket_id(WINDOW_BUCKET_TYPE, goal_query.hostname),
+                bucket_cache.find_bucket_id(AFK_BUCKET_TYPE, goal_query.hostname))
+    return bucket_ids
+
+def get_answerable_queries(goal_queries : list, bucket_ids : dict, server_url : str = None) -> list:
+    # Goals of a host without a window bucket, or without an afk bucket when afk time is filtered,
+    # would fail the whole query, they are left out when the buckets api answered, otherwise the
+    # server decides with find_bucket
+    if not get_bucket_cache(server_url).is_fresh():
+        return goal_queries
+    answerable = []
+    for goal_query in goal_queries:
+        window_bucket_id, afk_bucket_id = bucket_ids.get(goal_query.hostname, (None, None))
+        if not window_bucket_id is None and (not goal_query.filter_afk or not afk_bucket_id is None):
+            answerable.append(goal_query)
+    return answerable
+
+def bucket_expression(bucket_id : str, prefix : str, hostname : str = None) -> str:
+    # Concrete ids when known, otherwise the server picks with find_bucket
+    if not bucket_id is None:
+        return json.dumps(bucket_id)
+    if hostname is None:
+        return "find_bucket({})".format(json.dumps(prefix))
+    return "find_bucket({}, {})".format(json.dumps(prefix), json.dumps(hostname))
+
+def build_batch_query(goal_queries : list, bucket_ids : dict = None, intervals : bool = False) -> list:
+    # Window and afk buckets of a host are flooded once and shared by every goal of the batch,
+    # only the categorization is done per goal. Uncategorized events are dropped and the
+    # durations summed on the server so every goal answers with a single number.
+    # With intervals the merged time intervals are returned instead, so the answers of
+    # several servers can be combined without counting the same time twice.
+    if bucket_ids is None:
+        bucket_ids = {}
+
+    # Goals of hosts resolving to the same buckets share their events
+    query = []
+    host_events = {}
+    goal_sources = []
+    for goal_query in goal_queries:
+        window_bucket_id, afk_bucket_id = bucket_ids.get(goal_query.hostname, (None, None))
+        source = (bucket_expression(window_bucket_id, "aw-watcher-window", goal_query.hostname),
+            bucket_expression(afk_bucket_id, "aw-watcher-afk", goal_query.hostname))
+        goal_sources.append(source)
+        if source not in host_events:
+            host_events[source] = ["events_{}".format(len(host_events)), None]
+            query.append("{} = flood(query_bucket({}));".format(host_events[source][0], source[0]))
+
+        events_name, afk_events_name = host_events[source]
+        if goal_query.filter_afk and afk_events_name is None:
+            afk_events_name = host_events[source][1] = "afk_{}".format(events_name)
+            not_afk_name = "not_afk_{}".format(events_name[len("events_"):])
+            query.extend([
+                "{} = flood(query_bucket({}));".format(not_afk_name, source[1]),
+                "{} = filter_keyvals({}, \"status\", [\"not-afk\"]);".format(not_afk_name, not_afk_name),
+                "{} = filter_period_intersect({}, {});".format(afk_events_name, events_name, not_afk_name),
+            ])
+
+    returns = {}
+    for i, goal_query in enumerate(goal_queries):
+        name = "goal_{}".format(i)
+        events_name, afk_events_name = host_events[goal_sources[i]]
+        categorized = "exclude_keyvals(categorize({}, {}), \"$category\", {})".format(
+            afk_events_name if goal_query.filter_afk else events_name, goal_query.get_filters_json(), json.dumps([UNCATEGORIZED]))
+        if intervals:
+            query.append("{} = period_union({}, []);".format(name, categorized))
+        else:
+            query.append("{} = sum_durations({});".format(name, categorized))
+        returns[name] = "__{}__".format(name)
+
+    return_line = json.dumps(returns)
+    for name in returns.keys():
+        return_line = return_line.replace("\"__{}__\"".format(name), name)
+    query.append("RETURN = {};".format(return_line))
+    return query
+
+def filter_fingerprint(filters : list, filter_afk : bool, utc_offset : timedelta = None, filters_json : str = None,
+        hostname : str = None, server_urls : tuple = None) -> str:
+    # Same text as json.dumps([filters, filter_afk, utc_offset], sort_keys=True) without serializing the filters again,
+    # the hostname and servers are only added when they differ from the default so fingerprints of
+    # goals on the main server stay the same
+    if filters_json is None:
+        filters_json = json.dumps(filters, sort_keys=True)
+    utc_offset = None if utc_offset is None else utc_offset.total_seconds()
+    fingerprint_text = "[{}, {}, {}]".format(filters_json, json.dumps(bool(filter_afk)), json.dumps(utc_offset))
+    if not server_urls is None and list(server_urls) == [get_transport().server_url]:
+        server_urls = None
+    if not hostname is None or not server_urls is None:
+        fingerprint_text = "{}, {}]".format(fingerprint_text[:-1], json.dumps(hostname))
+    if not server_urls is None:
+        fingerprint_text = "{}, {}]".format(fingerprint_text[:-1], json.dumps(list(server_urls)))
+    # The default host counts this machine's buckets instead of the first bucket the server finds,
+    # progress stored before that must not be reused
+    if hostname is None:
+        fingerprint_text = "{}, {}]".format(fingerprint_text[:-1], json.dumps(DEFAULT_HOST_BUCKETS))
+    return hashlib.sha1(fingerprint_text.encode()).hexdigest()
+
+def group_by_timeperiod(goal_queries : list) -> dict:
+    # Goals sharing the same time period are answered by a single query
+    groups = {}
+    for goal_query in goal_queries:
+        groups.setdefault(goal_query.get_timeperiod(), []).append(goal_query)
+    return groups
+
+def fetch_hours_batch(goal_queries : list, partial : dict = None) -> dict:
+    results = {}
+    for timeperiod, group in group_by_timeperiod(goal_queries).items():
+        timeperiods = split_timeperiod(group[0].begin_date, group[0].end_date)
+        for key, hours in fetch_chunked_group_hours(timeperiods, group, partial=partial).items():
+            results[key] = None if hours is None else sum(hours)
+    return results
+
+def split_timeperiod(begin_date : datetime, end_date : datetime) -> list:
+    # Day periods covering the range, days follow the time zone of begin_date
+    timeperiods = []
+    period_begin = begin_date
+    while period_begin < end_date:
+        next_day = period_begin.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        period_end = min(next_day, end_date)
+        timeperiods.append("{}/{}".format(period_begin.isoformat(), period_end.isoformat()))
+        period_begin = next_day
+    return timeperiods
+
+def chunk_timeperiods(timeperiods : list, chunk_size : int = CHUNK_PERIODS) -> list:
+    return [timeperiods[i:i + chunk_size] for i in range(0, len(timeperiods), chunk_size)]
+
+def merge_chunk_hours(goal_queries : list, chunk_results : list) -> dict:
+    # Hours of the chunks in order, a goal fails if any of its chunks failed
+    results = {}
+    for goal_query in goal_queries:
+        hours = []
+        for chunk_result in chunk_results:
+            chunk_hours = chunk_result.get(goal_query.key)
+            if chunk_hours is None:
+                hours = None
+                break
+            hours.extend(chunk_hours)
+        results[goal_query.key] = hours
+    return results
+
+_fetch_executor = None
+_fetch_executor_lock = threading.Lock()
+
+def get_fetch_executor() -> ThreadPoolExecutor:
+    # Shared by every chunked fetch so aw-server never sees more than MAX_FETCH_WORKERS of them
+    global _fetch_executor
+    with _fetch_executor_lock:
+        if _fetch_executor is None:
+            _fetch_executor = ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS, thread_name_prefix="awfetch")
+        return _fetch_executor
+
+_server_executor = None
+
+def get_server_executor() -> ThreadPoolExecutor:
+    # Separate from the chunk pool, a chunk waiting for its servers must not wait for a free chunk worker
+    global _server_executor
+    with _fetch_executor_lock:
+        if _server_executor is None:
+            _server_executor = ThreadPoolExecutor(max_workers=MAX_SERVER_WORKERS, thread_name_prefix="awserver")
+        return _server_executor
+
+def fetch_chunked_group_hours(timeperiods : list, goal_queries : list, chunk_size : int = CHUNK_PERIODS, partial : dict = None) -> dict:
+    # partial collects the servers that did not answer for goals counted on several of them
+    chunks = chunk_timeperiods(timeperiods, chunk_size)
+    if len(chunks) == 1:
+        return fetch_group_hours(timeperiods, goal_queries, partial)
+    chunk_results = list(get_fetch_executor().map(lambda chunk: fetch_group_hours(chunk, goal_queries, partial), chunks))
+    return merge_chunk_hours(goal_queries, chunk_results)
+
+def build_group_request(timeperiods : list, goal_queries : list, bucket_ids : dict = None, intervals : bool = False) -> str:
+    if bucket_ids is None:
+        bucket_ids = resolve_bucket_ids(goal_queries)
     data = {
-        "query": [
-            "events = flood(query_bucket(find_bucket(\"aw-watcher-window\")));",
-            "browser_events = [];",
-            "audible_events = filter_keyvals(browser_events, \"audible\", [true]);",
-            "not_afk = flood(query_bucket(find_bucket(\"aw-watcher-afk\")));" if filter_afk else "",
-            "not_afk = filter_keyvals(not_afk, \"status\", [\"not-afk\"]);" if filter_afk else "",
-            "not_afk = period_union(not_afk, audible_events);" if filter_afk else "",
-            "events = filter_period_intersect(events, not_afk);" if filter_afk else "",
-            "events = categorize(events, {});".format(json.dumps(filters)),
-            "cat_events   = sort_by_duration(merge_events_by_keys(events, [\"$category\"]));",
-            "duration = sum_durations(events);",
-            "RETURN = {}".format(
-                 json.dumps(
-                    {
-                        "cat_events": "__cat_events__"
-                    }, indent=4
-                ).replace("\"__cat_events__\"", "cat_events"))
-        #{\n        \"window\": {\n            \"app_events\": app_events,\n            \"title_events\": title_events,\n            \"cat_events\": cat_events,\n            \"active_events\": not_afk,\n            \"duration\": duration\n        },\n        \"browser\": {\n            \"domains\": browser_domains,\n            \"urls\": browser_urls,\n            \"duration\": browser_duration\n        }\n    };"
-        ],
-        "timeperiods": [
-            "{}/{}".format(begin_date.isoformat(), end_date.isoformat())
-            #"2024-10-17T04:00:00+03:00/2024-10-18T04:00:00+03:00"
-        ]
+        "query": build_batch_query(goal_queries, bucket_ids, intervals),
+        "timeperiods": timeperiods
     }
-    data_json = json.dumps(data)
-    headers = {'Content-type': 'application/json'}
+    return json.dumps(data)
+
+def get_chunks(content) -> list:
+    # Response bodies are either read already or an iterable of chunks from a streamed response
+    return [content] if isinstance(content, (bytes, str)) else content
+
+def get_goal_index(name, goal_count : int):
+    # Index of a "goal_N" result name, None for anything else
+    if not isinstance(name, str) or not name.startswith("goal_") or not name[len("goal_"):].isdigit():
+        return None
+    index = int(name[len("goal_"):])
+    return index if index < goal_count else None
+
+def parse_group_hours(content, timeperiods : list, goal_queries : list) -> dict:
+    # The per period sums are added up as the body arrives, the response is never held as a whole
+    total_secs = [[0] * len(timeperiods) for _ in goal_queries]
+    with metrics.timed("aw.parse_seconds"):
+        for path, value in iter_json_values(get_chunks(content), 2):
+            if len(path) != 2 or not isinstance(value, (int, float)) or path[0] >= len(timeperiods):
+                continue
+            i = get_goal_index(path[1], len(goal_queries))
+            if not i is None:
+                total_secs[i][path[0]] = value
+
+    return {goal_query.key: [secs / 60 / 60 for secs in total_secs[i]] for i, goal_query in enumerate(goal_queries)}
+
+def parse_group_intervals(content, timeperiods : list, goal_queries : list) -> dict:
+    # goal key -> list of (begin, end) intervals in unix time for each period,
+    # events are decoded one at a time and only their range is kept
+    intervals = [[[] for _ in timeperiods] for _ in goal_queries]
+    with metrics.timed("aw.parse_seconds"):
+        for path, event in iter_json_values(get_chunks(content), 3):
+            if len(path) != 3 or not isinstance(event, dict) or path[0] >= len(timeperiods):
+                continue
+            i = get_goal_index(path[1], len(goal_queries))
+            if not i is None:
+                begin = datetime.fromisoformat(event["timestamp"].replace("Z", "+00:00")).timestamp()
+                intervals[i][path[0]].append((begin, begin + event["duration"]))
+
+    return {goal_query.key: intervals[i] for i, goal_query in enumerate(goal_queries)}
 
+def fetch_group_hours(timeperiods : list, goal_queries : list, partial : dict = None) -> dict:
+    # Returns the hours of every goal for each of the given time periods
+    results = {goal_query.key: None for goal_query in goal_queries}
+    server_groups = {}
+    for goal_query in goal_queries:
+        server_groups.setdefault(goal_query.get_server_urls(), []).append(goal_query)
+
+    for server_urls, group in server_groups.items():
+        if len(server_urls) == 1:
+            results.update(fetch_server_group_hours(server_urls[0], timeperiods, group))
+        else:
+            results.update(fetch_merged_group_hours(server_urls, timeperiods, group, partial))
+    return results
+
+def fetch_server_group_hours(server_url : str, timeperiods : list, goal_queries : list, intervals : bool = False,
+        deadline : float = None) -> dict:
+    # Hours, or intervals, of the goals on a single server, None for goals it could not answer.
+    # With a time.monotonic() deadline every request has short timeouts, the main server included,
+    # and the response is given up at the deadline so the worker is freed.
+    results = {goal_query.key: None for goal_query in goal_queries}
+    transport = get_server_transport(server_url, shared_main=deadline is None)
+    if deadline is None:
+        bucket_ids = resolve_bucket_ids(goal_queries, server_url=server_url)
+    else:
+        bucket_cache = get_bucket_cache(server_url)
+        if not bucket_cache.is_fresh():
+            bucket_cache.refresh(transport)
+        bucket_ids = resolve_bucket_ids(goal_queries, cached_only=True, server_url=server_url)
+    goal_queries = get_answerable_queries(goal_queries, bucket_ids, server_url)
+    if len(goal_queries) < 1:
+        return results
+
+    data_json = build_group_request(timeperiods, goal_queries, bucket_ids, intervals)
     try:
-        response = requests.post(AW_QUERY_URL, data=data_json, headers=headers)
-        total_secs = 0
-        
+        if not deadline is None and time.monotonic() > deadline:
+            return results
+        response = transport.query(data_json, stream=True)
         if response.status_code == 200:
-            results = json.loads(response.content)
-            for res in results:
-                if "cat_events" not in res.keys():
-                        continue
-                
-                for cat in res['cat_events']:
-                        if cat['data']['$category'][0] != "Uncategorized":
-                            total_secs += cat['duration']
-            return total_secs / 60 / 60
+            parse = parse_group_intervals if intervals else parse_group_hours
+            results.update(parse(transport.iter_content(response, deadline=deadline), timeperiods, goal_queries))
+        else:
+            # A bucket may have been removed, look them up again on the next fetch
+            get_bucket_cache(server_url).invalidate()
     except:
         pass
-    return None
+    return results
+
+_partial_lock = threading.Lock()
+
+def fetch_merged_group_hours(server_urls : tuple, timeperiods : list, goal_queries : list, partial : dict = None) -> dict:
+    # Every server is asked at once. The intervals of the servers that answered are merged per
+    # period, time tracked on several of them counts once. Servers that failed or are still busy
+    # after SERVER_WAIT_TIMEOUT are added to partial, a goal no server answered for is None.
+    deadline = time.monotonic() + SERVER_WAIT_TIMEOUT
+    futures = {server_url: get_server_executor().submit(fetch_server_group_hours, server_url, timeperiods, goal_queries, True, deadline)
+        for server_url in server_urls}
+    done, _ = wait(futures.values(), timeout=SERVER_WAIT_TIMEOUT)
+    server_results = {server_url: future.result() if future in done else {} for server_url, future in futures.items()}
+
+    results = {}
+    for goal_query in goal_queries:
+        answered = [server_result[goal_query.key] for server_result in server_results.values()
+            if not server_result.get(goal_query.key) is None]
+        missing = [server_url for server_url, server_result in server_results.items() if server_result.get(goal_query.key) is None]
+        if len(missing) > 0:
+            metrics.increment("aw.partial_results")
+            if not partial is None:
+                with _partial_lock:
+                    partial[goal_query.key] = sorted(set(partial.get(goal_query.key, [])) | set(missing))
+        if len(answered) < 1:
+            results[goal_query.key] = None
+            continue
+
+        hours = []
+        for period_index in range(len(timeperiods)):
+            intervals = merge_intervals([interval for goal_intervals in answered for interval in goal_intervals[period_index]])
+            hours.append(sum(end - begin for begin, end in intervals) / 60 / 60)
+        results[goal_query.key] = hours
+    return results
+
+def fetch_afk_state():
+    # True when the latest afk event reports afk, None if aw-server or the afk bucket can not be reached
+    try:
+        bucket_id = get_bucket_cache().find_bucket_id(AFK_BUCKET_TYPE)
+        if bucket_id is None:
+            return None
+
+        response = get_transport().get("/api/0/buckets/{}/events".format(bucket_id), params={"limit": 1})
+        if response.status_code != 200:
+            return None
+        events = response.json()
+        if len(events) < 1:
+            return None
+        return events[0]["data"].get("status") == "afk"
+    except:
+        return None
 
 def main():
     filter = [[['Work'], {'type': 'regex', 'ignore_case': True, 'regex': 'code'}]]
@@ -62,8 +395,12 @@ def main():
     end_date = datetime.now(timezone(timedelta(hours=3)))
     end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=0)
     print(fetch_hours(filter, begin_date=begin_date, end_date=end_date, filter_afk=True))
+    print(fetch_hours_batch([
+        GoalQuery(0, filter, begin_date, end_date, False),
+        GoalQuery(1, filter, begin_date, end_date, True)
+    ]))
 
     pass
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
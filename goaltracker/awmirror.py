@@ -0,0 +1,250 @@
+import os
+import json
+import socket
+import sqlite3
+import threading
+from datetime import datetime, timezone, timedelta
+
+from goaltracker.awtransport import get_sync_transport
+from goaltracker.categorize import compile_rules, categorize_data, UNCATEGORIZED
+from goaltracker.AfkIntervalCache import AfkIntervalCache
+from goaltracker import localengine
+from goaltracker.awbuckets import get_bucket_cache, WINDOW_BUCKET_TYPE, AFK_BUCKET_TYPE
+from goaltracker.jsonstream import iter_json_values
+
+# Events of a sync are decoded from the streamed response and written in batches of this size
+INSERT_BATCH_SIZE = 1000
+
+class EventMirror:
+    # Keeps a local copy of the window and afk buckets, only new events are pulled
+    # from aw-server and progress is computed from the local copy.
+    def __init__(self, db_path : str = None, history_days : int = 366):
+        if db_path is None:
+            app_folder = os.path.join(os.path.expanduser("~"), ".goaltracker")
+            os.makedirs(app_folder, exist_ok=True)
+            db_path = os.path.join(app_folder, "awmirror.db")
+
+        self.history_days = history_days
+        self.lock = threading.Lock()
+        # Held for a whole sync, so a background sync is skipped while another one runs
+        self.sync_lock = threading.Lock()
+        # Used from the fetch threads, every access goes through the lock
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+        self.init_db()
+        # afk bucket id -> not-afk intervals, loaded from the db on first use and extended by every sync
+        self.not_afk_caches = {}
+
+    def init_db(self):
+        cur = self.con.cursor()
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS MirrorBucket("
+                "bucket_id VARCHAR PRIMARY KEY NOT NULL,"
+                "type VARCHAR NOT NULL,"
+                "high_water_mark REAL,"
+                "hostname VARCHAR"
+            ")"
+        )
+        if "hostname" not in [row[1] for row in cur.execute("PRAGMA table_info(MirrorBucket)")]:
+            cur.execute("ALTER TABLE MirrorBucket ADD COLUMN hostname VARCHAR")
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS MirrorEvent("
+                "bucket_id VARCHAR NOT NULL,"
+                "event_id INTEGER NOT NULL,"
+                "begin_time REAL NOT NULL,"
+                "end_time REAL NOT NULL,"
+                "data VARCHAR NOT NULL,"
+                "PRIMARY KEY(bucket_id, event_id),"
+                "FOREIGN KEY(bucket_id) REFERENCES MirrorBucket(bucket_id)"
+            ")"
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS MirrorEventTime ON MirrorEvent(bucket_id, begin_time)")
+        self.con.commit()
+
+    @staticmethod
+    def parse_timestamp(timestamp : str) -> float:
+        return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+
+    def get_bucket_id(self, bucket_type : str, hostname : str = None):
+        # Same choice as BucketCache.find_bucket_id, this machine first when no host is given
+        with self.lock:
+            if hostname is None:
+                row = self.con.execute(
+                    "select bucket_id from MirrorBucket where type = (?) order by hostname is (?) desc, bucket_id limit 1",
+                    (bucket_type, socket.gethostname())
+                ).fetchone()
+            else:
+                row = self.con.execute(
+                    "select bucket_id from MirrorBucket where type = (?) and hostname = (?) order by bucket_id limit 1",
+                    (bucket_type, hostname)
+                ).fetchone()
+        return None if row is None else row[0]
+
+    def sync(self, wait : bool = True) -> bool:
+        # Returns False if aw-server could not be reached, the mirror stays usable with the events it has.
+        # Without wait a sync already running is not waited for and False is returned.
+        if not self.sync_lock.acquire(blocking=wait):
+            return False
+        try:
+            transport = get_sync_transport()
+            bucket_cache = get_bucket_cache()
+            if not bucket_cache.is_fresh():
+                bucket_cache.refresh(transport)
+            buckets = bucket_cache.get_buckets(cached_only=True)
+            if buckets is None:
+                return False
+            for bucket_id, bucket in buckets.items():
+                if bucket["type"] in (WINDOW_BUCKET_TYPE, AFK_BUCKET_TYPE):
+                    self.sync_bucket(bucket_id, bucket["type"], bucket["hostname"], transport)
+        except Exception:
+            return False
+        finally:
+            self.sync_lock.release()
+        return True
+
+    def sync_bucket(self, bucket_id : str, bucket_type : str, hostname : str = None, transport = None):
+        with self.lock:
+            row = self.con.execute(
+                "select high_water_mark from MirrorBucket where bucket_id = (?)", (bucket_id, )
+            ).fetchone()
+        if row is None or row[0] is None:
+            high_water_mark = (datetime.now(timezone.utc) - timedelta(days=self.history_days)).timestamp()
+        else:
+            # The latest event may still be growing by heartbeats, so it is fetched again
+            high_water_mark = row[0]
+
+        start = datetime.fromtimestamp(high_water_mark, timezone.utc).isoformat()
+        if transport is None:
+            transport = get_sync_transport()
+        response = transport.get("/api/0/buckets/{}/events".format(bucket_id), params={"start": start, "limit": -1}, stream=True)
+        if response.status_code != 200:
+            if response.status_code == 404:
+                get_bucket_cache().invalidate()
+            return
+
+        # The first sync pulls the whole history, events are written while the body arrives
+        # so only a batch of them is held at a time. Everything is one transaction, a sync
+        # that breaks off leaves the mirror as it was.
+        latest_begin = high_water_mark
+        not_afk_intervals = []
+        with self.lock:
+            cur = self.con.cursor()
+            try:
+                cur.execute(
+                    "INSERT INTO MirrorBucket(bucket_id, type, high_water_mark, hostname) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(bucket_id) DO UPDATE SET hostname = excluded.hostname",
+                    (bucket_id, bucket_type, high_water_mark, hostname)
+                )
+                rows = []
+                for _, event in iter_json_values(transport.iter_content(response), 1):
+                    begin_time = self.parse_timestamp(event["timestamp"])
+                    end_time = begin_time + event["duration"]
+                    rows.append((bucket_id, event["id"], begin_time, end_time, json.dumps(event["data"])))
+                    latest_begin = max(latest_begin, begin_time)
+                    if event["data"].get("status") == "not-afk":
+                        not_afk_intervals.append((begin_time, end_time))
+                    if len(rows) >= INSERT_BATCH_SIZE:
+                        self.insert_events(cur, rows)
+                        rows = []
+                self.insert_events(cur, rows)
+                cur.execute(
+                    "UPDATE MirrorBucket SET high_water_mark = (?) WHERE bucket_id = (?)",
+                    (latest_begin, bucket_id)
+                )
+                self.con.commit()
+            except:
+                self.con.rollback()
+                raise
+
+            if bucket_id in self.not_afk_caches:
+                self.not_afk_caches[bucket_id].extend(not_afk_intervals)
+
+    @staticmethod
+    def insert_events(cur : sqlite3.Cursor, rows : list):
+        cur.executemany(
+            "INSERT OR REPLACE INTO MirrorEvent(bucket_id, event_id, begin_time, end_time, data) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+
+    def get_events(self, bucket_id : str, begin_time : float, end_time : float) -> list:
+        # Events overlapping the range, clipped to it, as (begin, end, data) tuples
+        with self.lock:
+            rows = self.con.execute(
+                "select begin_time, end_time, data from MirrorEvent "
+                "where bucket_id = (?) and begin_time < (?) and end_time > (?) "
+                "order by begin_time",
+                (bucket_id, end_time, begin_time)
+            ).fetchall()
+        return [(max(begin, begin_time), min(end, end_time), json.loads(data)) for begin, end, data in rows]
+
+    def get_not_afk_cache(self, hostname : str = None):
+        afk_bucket_id = self.get_bucket_id(AFK_BUCKET_TYPE, hostname)
+        if afk_bucket_id is None:
+            return None
+        with self.lock:
+            if afk_bucket_id not in self.not_afk_caches:
+                rows = self.con.execute(
+                    "select begin_time, end_time, data from MirrorEvent where bucket_id = (?)", (afk_bucket_id, )
+                ).fetchall()
+                not_afk_cache = AfkIntervalCache()
+                not_afk_cache.load(afk_bucket_id, [(begin, end) for begin, end, data in rows
+                    if json.loads(data).get("status") == "not-afk"])
+                self.not_afk_caches[afk_bucket_id] = not_afk_cache
+            return self.not_afk_caches[afk_bucket_id]
+
+    def get_not_afk_periods(self, begin_time : float, end_time : float, hostname : str = None) -> list:
+        not_afk_cache = self.get_not_afk_cache(hostname)
+        if not_afk_cache is None:
+            return []
+        return not_afk_cache.get_periods(begin_time, end_time)
+
+    def fetch_hours(self, filters : list, begin_date : datetime, end_date : datetime, filter_afk : bool, hostname : str = None):
+        window_bucket_id = self.get_bucket_id(WINDOW_BUCKET_TYPE, hostname)
+        if window_bucket_id is None:
+            return None
+
+        begin_time, end_time = begin_date.timestamp(), end_date.timestamp()
+        events = self.get_events(window_bucket_id, begin_time, end_time)
+        not_afk_cache = self.get_not_afk_cache(hostname) if filter_afk else None
+
+        rules = compile_rules(filters)
+        total_secs = 0
+        for begin, end, data in events:
+            if categorize_data(rules, data) != UNCATEGORIZED:
+                if filter_afk:
+                    total_secs += 0 if not_afk_cache is None else not_afk_cache.get_covered(begin, end)
+                else:
+                    total_secs += end - begin
+        return total_secs / 60 / 60
+
+    def fetch_hours_batch(self, goal_queries : list) -> dict:
+        if not localengine.is_available():
+            return {goal_query.key: self.fetch_hours(goal_query.filters, goal_query.begin_date, goal_query.end_date, goal_query.filter_afk,
+                goal_query.hostname) for goal_query in goal_queries}
+
+        # Events of a host and time period are loaded once and shared by its goals, not-afk time
+        # of every goal comes from the shared interval cache of its host
+        groups = {}
+        for goal_query in goal_queries:
+            groups.setdefault((goal_query.begin_date.timestamp(), goal_query.end_date.timestamp(), goal_query.hostname), []).append(goal_query)
+
+        results = {}
+        for (begin_time, end_time, hostname), group in groups.items():
+            window_bucket_id = self.get_bucket_id(WINDOW_BUCKET_TYPE, hostname)
+            if window_bucket_id is None:
+                results.update({goal_query.key: None for goal_query in group})
+                continue
+
+            not_afk_cache = self.get_not_afk_cache(hostname) if any(goal_query.filter_afk for goal_query in group) else None
+            columns = localengine.EventColumns(self.get_events(window_bucket_id, begin_time, end_time))
+            for goal_query in group:
+                if not goal_query.filter_afk:
+                    results[goal_query.key] = localengine.total_hours(columns, goal_query.filters)
+                elif not_afk_cache is None:
+                    results[goal_query.key] = localengine.total_hours(columns, goal_query.filters, not_afk_periods=[])
+                else:
+                    results[goal_query.key] = localengine.total_hours(columns, goal_query.filters, not_afk_cache=not_afk_cache)
+        return results
+
+    def close(self):
+        with self.lock:
+            self.con.close()
@@ -0,0 +1,158 @@
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from goaltracker import metrics
+
+# Can be overridden with the GOALTRACKER_AW_URL environment variable or set_server_url
+AW_SERVER_URL = os.environ.get("GOALTRACKER_AW_URL", "http://localhost:5600")
+AW_QUERY_PATH = "/api/0/query/"
+
+CONNECT_TIMEOUT = 3.05 # seconds
+READ_TIMEOUT = 30 # seconds
+
+# Further servers, e.g. of a laptop and a desktop, are asked together with the main one.
+# Set with the comma separated GOALTRACKER_AW_URLS environment variable or set_server_urls.
+# Without retries a request gives up within CONNECT_TIMEOUT + SERVER_READ_TIMEOUT, below the
+# time awfetcher waits for the servers, so hung servers do not keep their workers.
+SERVER_READ_TIMEOUT = 10 # seconds, a slow server only makes its goals partial
+SERVER_RETRIES = 0
+
+# The event mirror syncs after answering from its local copy, a slow server is given up on
+# quickly and the events are pulled on the next refresh
+SYNC_READ_TIMEOUT = 5 # seconds
+
+# Streamed responses are read in chunks of this size
+STREAM_CHUNK_SIZE = 64 * 1024 # bytes
+
+class AwTransport:
+    def __init__(self, server_url : str = AW_SERVER_URL, connect_timeout : float = CONNECT_TIMEOUT, read_timeout : float = READ_TIMEOUT,
+            retries : int = 3, backoff_factor : float = 0.5, pool_size : int = 10):
+        self.server_url = server_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+
+        # Queries are read only so retrying posts is safe
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+            backoff_factor=backoff_factor, status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "POST"]), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        # A session keeps the connections alive between refreshes
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({'Content-type': 'application/json'})
+
+    def get_url(self, path : str) -> str:
+        return self.server_url + path
+
+    def post(self, path : str, data : str, stream : bool = False) -> requests.Response:
+        metrics.increment("aw.bytes_sent", len(data))
+        return self.request(lambda: self.session.post(self.get_url(path), data=data, timeout=self.timeout, stream=stream), stream)
+
+    def get(self, path : str, params : dict = None, stream : bool = False) -> requests.Response:
+        return self.request(lambda: self.session.get(self.get_url(path), params=params, timeout=self.timeout, stream=stream), stream)
+
+    def request(self, send, stream : bool = False) -> requests.Response:
+        # A streamed body is left unread, it is counted while iter_content reads it
+        metrics.increment("aw.requests")
+        begin = time.perf_counter()
+        try:
+            response = send()
+        except Exception:
+            metrics.increment("aw.request_errors")
+            raise
+        metrics.observe("aw.request_seconds", time.perf_counter() - begin)
+        if not stream:
+            metrics.increment("aw.bytes_received", len(response.content))
+        if response.status_code != 200:
+            metrics.increment("aw.request_errors")
+            if stream:
+                response.close()
+        return response
+
+    def query(self, data : str, stream : bool = False) -> requests.Response:
+        return self.post(AW_QUERY_PATH, data, stream)
+
+    def iter_content(self, response : requests.Response, chunk_size : int = STREAM_CHUNK_SIZE, deadline : float = None):
+        # Body of a streamed response in chunks, the connection goes back to the pool once it is read.
+        # Reading stops with a TimeoutError once the time.monotonic() deadline has passed.
+        try:
+            for chunk in response.iter_content(chunk_size):
+                if not deadline is None and time.monotonic() > deadline:
+                    raise TimeoutError("Response not read before the deadline")
+                metrics.increment("aw.bytes_received", len(chunk))
+                yield chunk
+        finally:
+            response.close()
+
+    def close(self):
+        self.session.close()
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport() -> AwTransport:
+    # Shared by every goal and fetch path
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = AwTransport()
+        return _transport
+
+_server_urls = [url.strip().rstrip("/") for url in os.environ.get("GOALTRACKER_AW_URLS", "").split(",") if url.strip()]
+_server_transports = {}
+
+def get_server_urls() -> list:
+    # Servers every goal is counted on unless it has its own list, the main server first
+    with _transport_lock:
+        server_urls = list(_server_urls)
+    main_url = get_transport().server_url
+    return [main_url] + [url for url in server_urls if url != main_url]
+
+def set_server_urls(server_urls : list):
+    global _server_urls
+    with _transport_lock:
+        _server_urls = [url.strip().rstrip("/") for url in server_urls if url.strip()]
+
+def get_server_transport(server_url : str, shared_main : bool = True) -> AwTransport:
+    # The main server uses the shared transport unless shared_main is False, the others
+    # get shorter timeouts and no retries
+    server_url = server_url.rstrip("/")
+    transport = get_transport()
+    if transport.server_url == server_url and shared_main:
+        return transport
+    with _transport_lock:
+        if server_url not in _server_transports:
+            _server_transports[server_url] = AwTransport(server_url=server_url, read_timeout=SERVER_READ_TIMEOUT, retries=SERVER_RETRIES)
+        return _server_transports[server_url]
+
+_sync_transport = None
+
+def get_sync_transport() -> AwTransport:
+    # The main server with a short read timeout and without retries
+    global _sync_transport
+    server_url = get_transport().server_url
+    with _transport_lock:
+        if _sync_transport is None or _sync_transport.server_url != server_url:
+            _sync_transport = AwTransport(server_url=server_url, read_timeout=SYNC_READ_TIMEOUT, retries=0)
+        return _sync_transport
+
+def set_server_url(server_url : str):
+    global _transport
+    with _transport_lock:
+        if not _transport is None:
+            if _transport.server_url == server_url.rstrip("/"):
+                return
+            _transport.close()
+        _transport = AwTransport(server_url=server_url)
+
+def set_server_settings(server_url : str = None, server_urls = None):
+    # Applies the aw_server_url and aw_server_urls settings, unset values keep the environment defaults
+    if server_url:
+        set_server_url(server_url)
+    if server_urls:
+        set_server_urls(server_urls if isinstance(server_urls, list) else str(server_urls).split(","))
@@ -0,0 +1,70 @@
+import re
+
+UNCATEGORIZED = ["Uncategorized"]
+
+class CategoryRule:
+    # Same matching rules as the aw-server categorize transform
+    def __init__(self, category : list, rule : dict):
+        self.category = category
+        self.select_keys = rule.get("select_keys", None)
+        self.ignore_case = rule.get("ignore_case", False)
+
+        # An empty regex would match everything, aw-server ignores it as well
+        regex = rule.get("regex", None)
+        self.regex = re.compile(regex, (re.IGNORECASE if self.ignore_case else 0) | re.UNICODE) if regex else None
+
+    def match(self, data : dict) -> bool:
+        if self.regex is None:
+            return False
+
+        if self.select_keys:
+            values = [data.get(key, None) for key in self.select_keys]
+        else:
+            values = data.values()
+
+        for value in values:
+            if isinstance(value, str) and self.regex.search(value):
+                return True
+        return False
+
+def compile_rules(filters : list) -> list:
+    # filters is the FilterConfiguration.to_aw_filter output, [[category path], rule]
+    return [CategoryRule(category, rule) for category, rule in filters if rule.get("type", "regex") == "regex"]
+
+def categorize_data(rules : list, data : dict) -> list:
+    # The deepest matching category wins, the last matching rule on ties like aw-server
+    best = None
+    for rule in rules:
+        if (best is None or len(rule.category) >= len(best)) and rule.match(data):
+            best = rule.category
+    return UNCATEGORIZED if best is None else best
+
+def merge_intervals(intervals : list) -> list:
+    # Sorts and merges overlapping (begin, end) intervals
+    merged = []
+    for begin, end in sorted(intervals):
+        if end <= begin:
+            continue
+        if len(merged) > 0 and begin <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([begin, end])
+    return [(begin, end) for begin, end in merged]
+
+def intersect_intervals(events : list, periods : list) -> list:
+    # events are (begin, end, data) tuples, periods sorted and merged (begin, end) intervals.
+    # Returns the parts of the events that fall into the periods.
+    result = []
+    events = sorted(events, key=lambda event: event[0])
+    period_index = 0
+    for begin, end, data in events:
+        while period_index < len(periods) and periods[period_index][1] <= begin:
+            period_index += 1
+
+        i = period_index
+        while i < len(periods) and periods[i][0] < end:
+            part_begin, part_end = max(begin, periods[i][0]), min(end, periods[i][1])
+            if part_end > part_begin:
+                result.append((part_begin, part_end, data))
+            i += 1
+    return result
@@ -0,0 +1,51 @@
+import json
+from collections import deque
+
+from goaltracker.awfetcher import filter_fingerprint
+
+# Qt free helpers for the filter trees stored in ActivityWatchFilter,
+# the output matches FilterConfiguration.to_aw_filter for the same tree.
+
+def filter_dict_to_aw_filter(data : dict) -> list:
+    result = []
+    if data is None or "sub_categories" not in data.keys():
+        return result
+
+    categories_stack = deque([[[], data["sub_categories"]]])
+    while len(categories_stack) > 0:
+        parent_path, sub_categories = categories_stack.popleft()
+        for category_info in sub_categories:
+            path = parent_path + [category_info["category"]]
+            result.append([path, {
+                "type" : "regex",
+                "ignore_case" : bool(category_info["ignore_case"]),
+                "regex" : category_info["filter"],
+            }])
+            if len(category_info["sub_categories"]) > 0:
+                categories_stack.append([path, category_info["sub_categories"]])
+    return result
+
+class FilterRules:
+    # Plain data stand-in for FilterConfiguration until its window is needed,
+    # offers the same compiled outputs, computed once since the data does not change.
+    def __init__(self, data : dict = None):
+        self.data = data if not data is None else {"sub_categories" : []}
+        self.cache = {}
+
+    def get_cached(self, name, create):
+        if name not in self.cache:
+            self.cache[name] = create()
+        return self.cache[name]
+
+    def to_dict(self) -> dict:
+        return self.data
+
+    def to_aw_filter(self) -> list:
+        return self.get_cached("aw_filter", lambda: filter_dict_to_aw_filter(self.data))
+
+    def get_filter_json(self) -> str:
+        return self.get_cached("filter_json", lambda: json.dumps(self.to_aw_filter(), sort_keys=True))
+
+    def get_filter_fingerprint(self, filter_afk : bool, utc_offset = None, hostname : str = None, server_urls : tuple = None) -> str:
+        return self.get_cached(("fingerprint", bool(filter_afk), utc_offset, hostname, server_urls),
+            lambda: filter_fingerprint(self.to_aw_filter(), filter_afk, utc_offset, self.get_filter_json(), hostname, server_urls))
@@ -0,0 +1,133 @@
+import re
+import json
+import codecs
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+NUMBER_TAIL = re.compile(r"[0-9+\-.eE]*")
+
+class JsonStreamParser:
+    # Incremental json parser for a document arriving in chunks. Arrays and objects above
+    # value_depth are walked without being built, every value at value_depth, and every
+    # scalar above it, is decoded on its own and reported with its path. Memory is bounded
+    # by the chunk size and the largest reported value instead of the whole document.
+    def __init__(self, value_depth : int):
+        self.value_depth = value_depth
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        # [container, key or index] of every open array or object
+        self.stack = []
+        self.state = "value"
+
+    def get_path(self) -> tuple:
+        return tuple(key for _, key in self.stack)
+
+    def feed(self, chunk : bytes, final : bool = False) -> list:
+        # Returns the (path, value) pairs completed by this chunk
+        self.buffer += self.utf8.decode(chunk, final)
+        values = []
+        pos = self.parse(values, final)
+        self.buffer = self.buffer[pos:]
+        return values
+
+    def close(self) -> list:
+        values = self.feed(b"", final=True)
+        if self.state != "done" or len(self.buffer.strip()) > 0:
+            raise ValueError("Incomplete json document")
+        return values
+
+    def end_value(self):
+        self.state = "done" if len(self.stack) < 1 else "comma_or_end"
+
+    def parse(self, values : list, final : bool) -> int:
+        buffer = self.buffer
+        pos = 0
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()
+            if pos >= len(buffer):
+                return pos
+            char = buffer[pos]
+
+            if self.state == "done":
+                raise ValueError("Extra data after json document at {}".format(pos))
+
+            if self.state in ("value", "value_or_end"):
+                if char == "]" and self.state == "value_or_end":
+                    self.stack.pop()
+                    self.end_value()
+                    pos += 1
+                elif char in "[{" and len(self.stack) < self.value_depth:
+                    self.stack.append([char, 0 if char == "[" else None])
+                    self.state = "value_or_end" if char == "[" else "key_or_end"
+                    pos += 1
+                else:
+                    try:
+                        value, end = self.decoder.raw_decode(buffer, pos)
+                    except json.JSONDecodeError:
+                        if final:
+                            raise
+                        return pos
+                    # A number running up to the end of the buffer may continue in the next chunk
+                    if isinstance(value, (int, float)) and not final and NUMBER_TAIL.match(buffer, end).end() >= len(buffer):
+                        return pos
+                    values.append((self.get_path(), value))
+                    self.end_value()
+                    pos = end
+
+            elif self.state in ("key", "key_or_end"):
+                if char == "}" and self.state == "key_or_end":
+                    self.stack.pop()
+                    self.end_value()
+                    pos += 1
+                elif char == "\"":
+                    try:
+                        key, end = self.decoder.raw_decode(buffer, pos)
+                    except json.JSONDecodeError:
+                        if final:
+                            raise
+                        return pos
+                    self.stack[-1][1] = key
+                    self.state = "colon"
+                    pos = end
+                else:
+                    raise ValueError("Expected object key at {}".format(pos))
+
+            elif self.state == "colon":
+                if char != ":":
+                    raise ValueError("Expected ':' at {}".format(pos))
+                self.state = "value"
+                pos += 1
+
+            elif self.state == "comma_or_end":
+                container = self.stack[-1]
+                if char == ",":
+                    if container[0] == "[":
+                        container[1] += 1
+                        self.state = "value"
+                    else:
+                        self.state = "key"
+                    pos += 1
+                elif char == ("]" if container[0] == "[" else "}"):
+                    self.stack.pop()
+                    self.end_value()
+                    pos += 1
+                else:
+                    raise ValueError("Expected ',' or end of container at {}".format(pos))
+
+def iter_json_values(chunks, value_depth : int):
+    # (path, value) pairs of a json document given as an iterable of byte chunks
+    parser = JsonStreamParser(value_depth)
+    for chunk in chunks:
+        for path_value in parser.feed(chunk):
+            yield path_value
+    for path_value in parser.close():
+        yield path_value
+
+def main():
+    document = json.dumps([{"goal_0": 3600.5, "goal_1": [{"timestamp": "2024-01-01T00:00:00+00:00", "duration": 60, "data": {}}]}])
+    chunks = [document[i:i + 7].encode() for i in range(0, len(document), 7)]
+    for path, value in iter_json_values(chunks, 3):
+        print(path, value)
+
+if __name__ == "__main__":
+    main()
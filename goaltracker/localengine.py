@@ -0,0 +1,148 @@
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from goaltracker.categorize import compile_rules
+
+def is_available() -> bool:
+    return not np is None
+
+class EventColumns:
+    # Events stored as columns, string values are interned so rules run once per distinct string
+    def __init__(self, events : list):
+        # events are (begin, end, data) tuples
+        self.begin = np.fromiter((event[0] for event in events), dtype=np.float64, count=len(events))
+        self.end = np.fromiter((event[1] for event in events), dtype=np.float64, count=len(events))
+        self.duration = self.end - self.begin
+
+        # data key -> (codes array, list of distinct strings), -1 codes mark missing values
+        self.string_columns = {}
+        interned = {}
+        for index, (_, _, data) in enumerate(events):
+            for key, value in data.items():
+                if not isinstance(value, str):
+                    continue
+                if key not in self.string_columns:
+                    self.string_columns[key] = (np.full(len(events), -1, dtype=np.int32), [])
+                    interned[key] = {}
+                codes, strings = self.string_columns[key]
+                code = interned[key].get(value)
+                if code is None:
+                    code = len(strings)
+                    interned[key][value] = code
+                    strings.append(value)
+                codes[index] = code
+
+    def __len__(self):
+        return len(self.begin)
+
+class CategoryMatcher:
+    def __init__(self, filters : list):
+        self.rules = compile_rules(filters)
+        self.categories = [tuple(rule.category) for rule in self.rules]
+
+        # Deepest category wins, the last rule on ties, like aw-server
+        self.scores = np.array([len(rule.category) * (len(self.rules) + 1) + i
+            for i, rule in enumerate(self.rules)], dtype=np.int64)
+
+        # All rules combined into one pattern, strings that do not match it skip the per rule pass
+        self.combined = None
+        patterns = ["(?{}:{})".format("i" if rule.ignore_case else "", rule.regex.pattern)
+            for rule in self.rules if not rule.regex is None]
+        # Group references would point to the wrong groups once the patterns are joined
+        has_references = any(len(rule.regex.groupindex) > 0 or re.search(r"\\[1-9]", rule.regex.pattern)
+            for rule in self.rules if not rule.regex is None)
+        if len(patterns) > 0 and not has_references:
+            try:
+                self.combined = re.compile("|".join(patterns), re.UNICODE)
+            except re.error:
+                self.combined = None
+
+    def match_strings(self, rule_index : int, strings : list, candidates : np.ndarray) -> np.ndarray:
+        regex = self.rules[rule_index].regex
+        matched = np.zeros(len(strings), dtype=bool)
+        if regex is None:
+            return matched
+        for code in np.flatnonzero(candidates):
+            matched[code] = regex.search(strings[code]) is not None
+        return matched
+
+    def categorize(self, columns : EventColumns) -> np.ndarray:
+        # Returns the winning rule index per event, -1 for uncategorized events
+        best_score = np.full(len(columns), -1, dtype=np.int64)
+        best_rule = np.full(len(columns), -1, dtype=np.int64)
+        if len(self.rules) == 0 or len(columns) == 0:
+            return best_rule
+
+        candidates = {}
+        for key, (codes, strings) in columns.string_columns.items():
+            if self.combined is None:
+                candidates[key] = np.ones(len(strings), dtype=bool)
+            else:
+                candidates[key] = np.fromiter((self.combined.search(string) is not None for string in strings),
+                    dtype=bool, count=len(strings))
+
+        for rule_index, rule in enumerate(self.rules):
+            keys = rule.select_keys if rule.select_keys else columns.string_columns.keys()
+            event_matched = np.zeros(len(columns), dtype=bool)
+            for key in keys:
+                if key not in columns.string_columns:
+                    continue
+                codes, strings = columns.string_columns[key]
+                string_matched = self.match_strings(rule_index, strings, candidates[key])
+                present = codes >= 0
+                event_matched[present] |= string_matched[codes[present]]
+
+            better = event_matched & (self.scores[rule_index] > best_score)
+            best_score[better] = self.scores[rule_index]
+            best_rule[better] = rule_index
+        return best_rule
+
+def covered_durations(begin : np.ndarray, end : np.ndarray, periods : list) -> np.ndarray:
+    # Length of each [begin, end) range covered by the sorted, merged periods
+    if len(periods) == 0:
+        return np.zeros(len(begin), dtype=np.float64)
+
+    period_begin = np.array([period[0] for period in periods], dtype=np.float64)
+    period_end = np.array([period[1] for period in periods], dtype=np.float64)
+    covered_before = np.concatenate(([0.0], np.cumsum(period_end - period_begin)))
+    return covered_durations_sorted(begin, end, period_begin, period_end, covered_before)
+
+def covered_durations_sorted(begin : np.ndarray, end : np.ndarray, period_begin : np.ndarray, period_end : np.ndarray,
+        covered_before : np.ndarray) -> np.ndarray:
+    # Same as covered_durations with the periods already as arrays and their prefix sums
+    if len(period_begin) == 0:
+        return np.zeros(len(begin), dtype=np.float64)
+    period_length = period_end - period_begin
+
+    def covered_until(times : np.ndarray) -> np.ndarray:
+        index = np.searchsorted(period_begin, times, side="right") - 1
+        inside = np.clip(times - period_begin[np.maximum(index, 0)], 0, period_length[np.maximum(index, 0)])
+        return np.where(index >= 0, covered_before[np.maximum(index, 0)] + inside, 0.0)
+
+    return covered_until(end) - covered_until(begin)
+
+def category_durations(columns : EventColumns, matcher : CategoryMatcher, not_afk_periods : list = None, not_afk_cache = None) -> dict:
+    # Seconds per category path, uncategorized events are left out. Not-afk time
+    # comes from the periods list or from an AfkIntervalCache.
+    durations = columns.duration
+    if not not_afk_cache is None:
+        durations = covered_durations_sorted(columns.begin, columns.end, *not_afk_cache.get_arrays())
+    elif not not_afk_periods is None:
+        durations = covered_durations(columns.begin, columns.end, not_afk_periods)
+    best_rule = matcher.categorize(columns)
+    categorized = best_rule >= 0
+    sums = np.bincount(best_rule[categorized], weights=durations[categorized], minlength=len(matcher.rules))
+
+    result = {}
+    for rule_index, seconds in enumerate(sums):
+        if seconds > 0:
+            category = matcher.categories[rule_index]
+            result[category] = result.get(category, 0) + float(seconds)
+    return result
+
+def total_hours(columns : EventColumns, filters : list, not_afk_periods : list = None, not_afk_cache = None) -> float:
+    return sum(category_durations(columns, CategoryMatcher(filters), not_afk_periods, not_afk_cache).values()) / 60 / 60
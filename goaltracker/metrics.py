@@ -0,0 +1,149 @@
+import os
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets, latencies in seconds and sizes in bytes share
+# the same log scale, the last bucket catches everything above.
+HISTOGRAM_BOUNDS = [10 ** (exponent / 4) for exponent in range(-24, 33)]
+
+# When set the gui appends a snapshot to this file every DUMP_INTERVAL
+METRICS_FILE = os.environ.get("GOALTRACKER_METRICS_FILE")
+DUMP_INTERVAL = 60 # seconds
+
+def get_metrics_path() -> str:
+    if METRICS_FILE:
+        return METRICS_FILE
+    return os.path.join(os.path.expanduser("~"), ".goaltracker", "metrics.jsonl")
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+    def observe(self, value : float):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+        low, high = 0, len(HISTOGRAM_BOUNDS)
+        while low < high:
+            middle = (low + high) // 2
+            if value <= HISTOGRAM_BOUNDS[middle]:
+                high = middle
+            else:
+                low = middle + 1
+        self.buckets[low] += 1
+
+    def get_percentile(self, percentile : float) -> float:
+        # Upper bound of the bucket holding the percentile, clamped to the observed range
+        if self.count < 1:
+            return 0.0
+        rank = percentile / 100 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank and bucket_count > 0:
+                bound = HISTOGRAM_BOUNDS[index] if index < len(HISTOGRAM_BOUNDS) else self.max
+                return max(self.min, min(bound, self.max))
+        return self.max
+
+    def to_dict(self) -> dict:
+        if self.count < 1:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "p50": self.get_percentile(50),
+            "p95": self.get_percentile(95),
+            "p99": self.get_percentile(99),
+            "max": self.max
+        }
+
+class MetricsRegistry:
+    # Counters, gauges and histograms shared by the fetch threads, the db and the gui
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, name : str, value : float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name : str, value : float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name : str, value : float):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timed(self, name : str):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - begin)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "timestamp": time.time(),
+                "uptime": time.time() - self.started,
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()}
+            }
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters.clear()
+            self.histograms.clear()
+
+    def dump_json_lines(self, path : str):
+        # One snapshot per line, appended so a file can collect a whole session
+        line = json.dumps(self.snapshot(), sort_keys=True)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "a") as file:
+            file.write(line + "\n")
+
+_metrics = MetricsRegistry()
+
+def get_metrics() -> MetricsRegistry:
+    return _metrics
+
+def increment(name : str, value : float = 1):
+    _metrics.increment(name, value)
+
+def set_gauge(name : str, value : float):
+    _metrics.set_gauge(name, value)
+
+def observe(name : str, value : float):
+    _metrics.observe(name, value)
+
+def timed(name : str):
+    return _metrics.timed(name)
+
+def main():
+    for i in range(1000):
+        observe("demo.seconds", (i % 100) / 1000)
+    increment("demo.requests", 1000)
+    print(json.dumps(get_metrics().snapshot(), indent=2))
+
+if __name__ == "__main__":
+    main()
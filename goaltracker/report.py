@@ -0,0 +1,96 @@
+import json
+import math
+import sys
+import time
+
+from goaltracker.GoalTrackerDb import GoalTrackerDb
+from goaltracker.ProgressAccumulator import ProgressAccumulator
+from goaltracker.awfetcher import GoalQuery
+from goaltracker.awtransport import set_server_settings
+from goaltracker.Goal import Goal
+from goaltracker.filters import filter_dict_to_aw_filter
+
+# Headless progress report, must not import Qt so it stays cheap for cron jobs and status bars.
+# Percent and pace are computed per goal like GoalRegistry does, without pulling in numpy.
+
+def get_percent(goal : Goal) -> float:
+    return goal.current_progress * 100 / goal.target if goal.target > 0 else 0.0
+
+def get_pace(goal : Goal, now : float) -> float:
+    # Progress relative to an even spread of the target over the period, NaN when the period
+    # is unknown or has not started yet
+    begin_date, end_date = goal.get_date_range()
+    if begin_date is None or end_date is None:
+        return math.nan
+    begin, end = begin_date.timestamp(), end_date.timestamp()
+    expected = goal.target * min(max((now - begin) / (end - begin), 0.0), 1.0) if end > begin else math.nan
+    return goal.current_progress / expected if expected > 0 else math.nan
+
+def compute_progress(goal_tracker_db : GoalTrackerDb, max_workers : int = 4) -> list:
+    # Same servers as the widget, which stores its settings in the db
+    set_server_settings(goal_tracker_db.get_setting("aw_server_url"), goal_tracker_db.get_setting("aw_server_urls"))
+    active_goals = goal_tracker_db.load_active_goals_with_filters()
+
+    goal_queries = []
+    for goal, goal_filter in active_goals:
+        filters = filter_dict_to_aw_filter(goal_filter)
+        if len(filters) < 1:
+            continue
+        begin_date, end_date = goal.get_date_range()
+        goal_queries.append(GoalQuery(goal.goal_id, filters, begin_date, end_date, goal.filter_afk, hostname=goal.hostname,
+            server_urls=goal.server_urls))
+
+    progress_accumulator = ProgressAccumulator()
+    progress_accumulator.load_daily_progress(goal_tracker_db, goal_queries)
+    partial = {}
+    results = progress_accumulator.fetch_hours(goal_queries, max_workers=max_workers, partial=partial)
+    progress_accumulator.store_daily_progress(goal_tracker_db)
+
+    now = time.time()
+    report = []
+    for goal, _ in active_goals:
+        stale = False
+        # Goals without filter rows are not queried, they keep their stored last_progress
+        if goal.goal_id in results:
+            hours = results[goal.goal_id]
+            # Last stored progress is reported when activity watch could not be asked
+            if hours is None:
+                stale = True
+            else:
+                goal.current_progress = hours
+
+        pace = get_pace(goal, now)
+        report.append({
+            "goal_id": goal.goal_id,
+            "name": goal.name,
+            "goal_type": goal.goal_type,
+            "target": goal.target,
+            "progress": goal.current_progress,
+            "percent": get_percent(goal),
+            # None before the period started
+            "pace": None if math.isnan(pace) else pace,
+            "completed": goal.target > 0 and goal.current_progress >= goal.target,
+            "stale": stale,
+            # Servers that did not answer, progress only counts the others
+            "partial": partial.get(goal.goal_id, []),
+        })
+    return report
+
+def print_report(report : list, as_json : bool = False, out = sys.stdout):
+    if as_json:
+        json.dump(report, out)
+        out.write("\n")
+        return
+
+    for goal in report:
+        out.write("{:<24} {:>8} {:>8.1f}/{:<8.1f} {:>6.1f}%{}\n".format(goal["name"], goal["goal_type"], goal["progress"],
+            goal["target"], goal["percent"], " (stale)" if goal["stale"] else " (partial)" if goal["partial"] else ""))
+
+def print_status(report : list, as_json : bool = False, out = sys.stdout):
+    # Single line, meant for status bars
+    if as_json:
+        json.dump({goal["name"]: round(goal["percent"], 1) for goal in report}, out)
+        out.write("\n")
+        return
+
+    out.write(" | ".join("{} {:.0f}%".format(goal["name"], goal["percent"]) for goal in report) + "\n")
@@ -0,0 +1,93 @@
+import asyncio
+
+from PyQt5.QtCore import QObject, QTimer
+
+from goaltracker.asyncfetcher import AsyncAwTransport, fetch_hours_batch_async, fetch_hours_incremental_async
+from goaltracker.awtransport import get_transport
+from goaltracker.ProgressAccumulator import ProgressAccumulator
+
+class FetchEngines:
+    THREAD_POOL = "threadpool"
+    ASYNCIO = "asyncio"
+
+class AsyncFetchEngine(QObject):
+    # Runs every fetch on the gui thread, the asyncio loop is stepped
+    # from a Qt timer only while there are fetches in flight.
+    PUMP_INTERVAL = 5 # ms
+
+    def __init__(self, max_concurrency : int = 4, parent : QObject = None):
+        super().__init__(parent)
+        self.loop = asyncio.new_event_loop()
+        self.max_concurrency = max_concurrency
+        self.transport = None
+
+        # task -> [goal keys of the task, cancelled goal keys]
+        self.tasks = {}
+
+        self.pump_timer = QTimer(self)
+        self.pump_timer.setInterval(self.PUMP_INTERVAL)
+        self.pump_timer.timeout.connect(self.pump)
+
+    def get_async_transport(self) -> AsyncAwTransport:
+        # Created lazily so a changed server url is picked up
+        server_url = get_transport().server_url
+        if self.transport is None or self.transport.server_url != server_url:
+            if not self.transport is None:
+                self.transport.close()
+            self.transport = AsyncAwTransport(server_url=server_url, max_concurrency=self.max_concurrency)
+        return self.transport
+
+    def submit(self, goal_queries : list, progress_accumulator : ProgressAccumulator, callback):
+        transport = self.get_async_transport()
+        if progress_accumulator is None:
+            coroutine = fetch_hours_batch_async(transport, goal_queries)
+        else:
+            coroutine = fetch_hours_incremental_async(transport, progress_accumulator, goal_queries)
+
+        task = self.loop.create_task(coroutine)
+        self.tasks[task] = [set(goal_query.key for goal_query in goal_queries), set()]
+
+        def on_done(task : asyncio.Task):
+            keys, cancelled = self.tasks.pop(task)
+            if task.cancelled() or not task.exception() is None:
+                callback({})
+                return
+            results = {key: hours for key, hours in task.result().items() if key not in cancelled}
+            callback(results)
+        task.add_done_callback(on_done)
+
+        if not self.pump_timer.isActive():
+            self.pump_timer.start()
+
+    def cancel(self, key):
+        # Results of the goal are dropped, the request itself is cancelled
+        # once no other goal is waiting for it.
+        for task, (keys, cancelled) in self.tasks.items():
+            if key in keys:
+                cancelled.add(key)
+                if cancelled == keys:
+                    task.cancel()
+
+    def pump(self):
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+        if len(self.tasks) == 0:
+            self.pump_timer.stop()
+
+    def shutdown(self):
+        # Called when the app quits, fetches in flight are cancelled, the connections closed and the loop with them
+        if self.loop.is_closed():
+            return
+        self.pump_timer.stop()
+        tasks = list(self.tasks.keys())
+        for task in tasks:
+            task.cancel()
+        if len(tasks) > 0:
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        if not self.transport is None:
+            self.transport.close()
+            self.transport = None
+        # One more pass lets the closed connections release their sockets
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        self.loop.close()
@@ -1,8 +1,8 @@
 import sys
 from datetime import datetime
 
-from PyQt5.QtCore import Qt, QRectF, pyqtSignal, QTimer, QThread, QThreadPool
-from PyQt5.QtGui import QPainter, QColor, QFont, QPen
+from PyQt5.QtCore import Qt, QRectF, pyqtSignal
+from PyQt5.QtGui import QPainter, QColor, QFont, QPen, QPixmap
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, \
     QLabel, QMenu, QAction, QLineEdit, QPushButton, \
     QDoubleSpinBox, QComboBox,QDateTimeEdit, QSizePolicy, \
@@ -10,11 +10,17 @@ from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, \
 
 from goaltracker.ui.FilterConfiguration import FilterConfiguration
 from goaltracker.Goal import Goal, GoalTypes
-from goaltracker.awfetcher import fetch_hours
+from goaltracker.awfetcher import GoalQuery
+from goaltracker.filters import FilterRules
+from goaltracker.awbuckets import get_bucket_cache
+from goaltracker.ui.MetricsWindow import show_metrics_window
+from goaltracker import metrics
 
 class GoalEditor(QWidget):
     signal_goal_edited = pyqtSignal(Goal)
 
+    DEFAULT_HOST = "This machine"
+
     def __init__(self, goal : Goal):
         super().__init__()
 
@@ -74,6 +80,29 @@ class GoalEditor(QWidget):
         grid.addWidget(self.dte_end_date, current_row, WIDGET_COL)
         current_row += 1
 
+        # Hosts known from the last bucket lookup, any other host can be typed in
+        self.combo_hostname = QComboBox()
+        self.combo_hostname.setEditable(True)
+        self.combo_hostname.addItem(self.DEFAULT_HOST)
+        hostnames = get_bucket_cache().get_hostnames(cached_only=True)
+        if not self.goal.hostname is None and self.goal.hostname not in hostnames:
+            hostnames.append(self.goal.hostname)
+        self.combo_hostname.addItems(hostnames)
+        if not self.goal.hostname is None:
+            self.combo_hostname.setCurrentText(self.goal.hostname)
+        self.combo_hostname.setSizePolicy(QSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed))
+        grid.addWidget(QLabel("Host: "), current_row, LABEL_COL)
+        grid.addWidget(self.combo_hostname, current_row, WIDGET_COL)
+        current_row += 1
+
+        # Comma separated aw-server urls, empty for the configured servers
+        self.le_server_urls = QLineEdit(", ".join(self.goal.server_urls or []))
+        self.le_server_urls.setPlaceholderText("Configured servers")
+        self.le_server_urls.setSizePolicy(QSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed))
+        grid.addWidget(QLabel("Servers: "), current_row, LABEL_COL)
+        grid.addWidget(self.le_server_urls, current_row, WIDGET_COL)
+        current_row += 1
+
         self.btn_done = QPushButton("Done")
         self.btn_done.clicked.connect(self.update_goal)
         self.btn_done.setMinimumSize(50, 30)
@@ -90,6 +119,10 @@ class GoalEditor(QWidget):
         self.goal.name = self.le_name.text()
         self.goal.target = self.dsp_goal.value()
         self.goal.goal_type = self.combo_goal_type.currentText()
+        hostname = self.combo_hostname.currentText().strip()
+        self.goal.hostname = None if hostname in ("", self.DEFAULT_HOST) else hostname
+        server_urls = [url.strip() for url in self.le_server_urls.text().split(",") if url.strip()]
+        self.goal.server_urls = server_urls if len(server_urls) > 0 else None
         if self.goal.goal_type == GoalTypes.CUSTOM:
             self.goal.begin_date = self.dte_begin_date.dateTime().toPyDateTime()
             self.goal.end_date = self.dte_end_date.dateTime().toPyDateTime()
@@ -98,23 +131,23 @@ class GoalEditor(QWidget):
 
 class CircularProgress(QWidget):
     signal_remove = pyqtSignal(QWidget)
+    signal_refresh = pyqtSignal(QWidget)
 
     signal_goal_edited = pyqtSignal(Goal)
-    signal_goal_progressed = pyqtSignal(Goal)
     signal_filter_update = pyqtSignal(int, FilterConfiguration)
 
     def __init__(self, goal : Goal = None, filter : dict = None , dict_values = None, max_width=300, max_height=300, parent = None):
         super().__init__(parent)
         self.goal = goal
 
+        # Editor and filter windows are built on first use, until then the rules are kept as plain data
+        self.filter_rules = FilterRules(filter)
+        self.filterConfig = None
+        self.goal_editor = None
 
         # If a dict is given try loading goal and filter from it
         if not dict_values is None:
             self.from_dict(dict_values)
-        
-        self.filterConfig = FilterConfiguration(data=filter, parent=self, filter_afk=self.goal.filter_afk)
-
-        self.goal_editor = GoalEditor(self.goal)
 
         vbox = QVBoxLayout(self)
         self.lbl_progress = QLabel("{:.1f}%".format(self.goal.current_progress / self.goal.target * 100))
@@ -136,46 +169,75 @@ class CircularProgress(QWidget):
         self.line_width_ratio = 0.05  # Line thickness as a ratio of the widget size
         self.bg_color = QColor(200, 200, 200)  # Background color (gray)
         self.progress_color = QColor(0, 150, 0)  # Progress color (blue)
+        self.partial_color = QColor(220, 150, 0)  # Progress color while a server did not answer (amber)
         self.text_color = QColor(50, 50, 50)  # Color for the text in the center
+
+        # Paint resources, rebuilt only when the widget size changes
+        self.ring_rect = QRectF()
+        self.progress_pen = QPen(QColor(self.progress_color).darker(), 1, Qt.SolidLine)
+        self.partial_pen = QPen(QColor(self.partial_color), 1, Qt.SolidLine)
+        self.background_pixmap = None
+        # Servers that did not answer the last fetch, the shown progress is a lower bound then
+        self.missing_servers = None
+        self.update_geometry()
+
         self.resize(self.max_width, self.max_height)  # Set the initial size of the widget
 
         self.setMinimumSize(self.max_width // 2, self.max_height // 2)
 
-        self.refresh_timer = QTimer()
-        self.refresh_timer.timeout.connect(self.on_refresh)
-        self.refresh_timer.setInterval(60 * 1000) # 1 minute intervals
-        self.refresh_timer.start()
-
         self.setContextMenuPolicy(3)  # Qt.CustomContextMenu
         self.customContextMenuRequested.connect(self.show_context_menu)
-        self.goal_editor.signal_goal_edited.connect(self.on_goal_edited)
-        self.filterConfig.signal_close_window.connect(self.on_filter_window_close)
 
-        self.fetch_thread_pool = QThreadPool(self)
+    def get_filter_config(self) -> FilterConfiguration:
+        if self.filterConfig is None:
+            self.filterConfig = FilterConfiguration(data=self.filter_rules.to_dict(), parent=self, filter_afk=self.goal.filter_afk)
+            self.filterConfig.signal_filter_changed.connect(self.on_filter_changed)
+        return self.filterConfig
+
+    def get_goal_editor(self) -> GoalEditor:
+        if self.goal_editor is None:
+            self.goal_editor = GoalEditor(self.goal)
+            self.goal_editor.signal_goal_edited.connect(self.on_goal_edited)
+        return self.goal_editor
+
+    def get_filter_source(self):
+        # The filter window owns the rules once it exists
+        return self.filter_rules if self.filterConfig is None else self.filterConfig
+
+    def flush_pending_filter_save(self):
+        if not self.filterConfig is None:
+            self.filterConfig.flush_pending_save()
 
     def on_refresh(self):
-        def fetch_data():
-            if self.filterConfig.model.rowCount() < 1:
-                return
-            begin_date, end_date = self.goal.get_date_range()
-            hours = fetch_hours(self.filterConfig.to_aw_filter(), begin_date, end_date, self.goal.filter_afk)
-            if not hours is None:
-                self.on_goal_progress(hours)
-        self.fetch_thread_pool.start(fetch_data)
+        self.signal_refresh.emit(self)
+
+    def create_goal_query(self):
+        filter_source = self.get_filter_source()
+        if len(filter_source.to_aw_filter()) < 1:
+            return None
+        begin_date, end_date = self.goal.get_date_range()
+        goal_query = GoalQuery(self.goal.goal_id, filter_source.to_aw_filter(), begin_date, end_date, self.goal.filter_afk,
+            filters_json=filter_source.get_filter_json(), hostname=self.goal.hostname, server_urls=self.goal.server_urls)
+        goal_query.fingerprint = filter_source.get_filter_fingerprint(self.goal.filter_afk, begin_date.utcoffset(), self.goal.hostname,
+            goal_query.get_server_urls())
+        return goal_query
 
         
-    def on_filter_window_close(self):
+    def on_filter_changed(self):
         self.goal.filter_afk = self.filterConfig.filter_afk
         self.signal_filter_update.emit(self.goal.goal_id, self.filterConfig)
 
     def from_dict(self, dict_values):
         self.goal.from_dict(dict_values["goal"])
-        self.filterConfig.from_dict(dict_values["aw-filters"])
+        if self.filterConfig is None:
+            self.filter_rules = FilterRules(dict_values["aw-filters"])
+        else:
+            self.filterConfig.from_dict(dict_values["aw-filters"])
 
     def to_dict(self):
         return {
             "goal" : self.goal.to_dict(),
-            "aw-filters": self.filterConfig.to_dict()
+            "aw-filters": self.get_filter_source().to_dict()
         }
 
     def on_goal_edited(self):
@@ -183,8 +245,9 @@ class CircularProgress(QWidget):
         self.signal_goal_edited.emit(self.goal)
 
     def edit_values_pop_up(self):
-        if not self.goal_editor.isActiveWindow():
-            self.goal_editor.show()
+        goal_editor = self.get_goal_editor()
+        if not goal_editor.isActiveWindow():
+            goal_editor.show()
 
     def show_context_menu(self, position):
         # Create a QMenu object
@@ -196,6 +259,7 @@ class CircularProgress(QWidget):
         action3 = QAction("Delete", self)
         action4 = QAction("Quit", self)
         actionRefresh = QAction("Refresh", self)
+        actionMetrics = QAction("Metrics", self)
 
         # Connect actions to methods
         action1.triggered.connect(self.edit_goal_action)
@@ -203,11 +267,13 @@ class CircularProgress(QWidget):
         action3.triggered.connect(self.delete_action)
         action4.triggered.connect(QApplication.instance().quit)
         actionRefresh.triggered.connect(self.on_refresh)
+        actionMetrics.triggered.connect(show_metrics_window)
 
         # Add the actions to the menu
         menu.addAction(action1)
         menu.addAction(action2)
         menu.addAction(actionRefresh)
+        menu.addAction(actionMetrics)
         menu.addAction(action3)
         menu.addAction(action4)
 
@@ -218,23 +284,24 @@ class CircularProgress(QWidget):
         self.edit_values_pop_up()
     
     def configure_aw_filter_action(self):
-        self.filterConfig.show()
+        self.get_filter_config().show()
     
     def delete_action(self):
         self.signal_remove.emit(self)
 
-    def on_goal_progress(self, current_progress):
+    def on_goal_progress(self, current_progress, missing_servers : list = None):
         self.goal.current_progress = current_progress
+        self.missing_servers = missing_servers
         self.lbl_progress.setText("{:.1f}%".format(self.goal.current_progress / self.goal.target * 100))
-        self.lbl_progress_count.setText("{:.1f}/{:.1f}".format(self.goal.current_progress, self.goal.target))
-        self.repaint()  # Redraw the widget whenever the value changes
-        self.signal_goal_progressed.emit(self.goal)
-
-    def paintEvent(self, event):
-        # Painter setup
-        painter = QPainter(self)
-        painter.setRenderHint(QPainter.Antialiasing)
+        if missing_servers:
+            self.lbl_progress_count.setText("{:.1f}/{:.1f} (partial)".format(self.goal.current_progress, self.goal.target))
+            self.setToolTip("No answer from {}".format(", ".join(missing_servers)))
+        else:
+            self.lbl_progress_count.setText("{:.1f}/{:.1f}".format(self.goal.current_progress, self.goal.target))
+            self.setToolTip("")
+        self.update()  # Schedule a redraw, coalesced with the other pending updates
 
+    def update_geometry(self):
         # Determine size and position based on the current widget size
         size = min(self.width(), self.height())  # Choose the smaller dimension
         line_width = int(size * self.line_width_ratio)
@@ -246,41 +313,68 @@ class CircularProgress(QWidget):
         self.setContentsMargins(horizontal_pad, vertical_pad,
                                 horizontal_pad, vertical_pad)
 
-        rect = QRectF(left, top,
+        self.ring_rect = QRectF(left, top,
                       size - 2 * line_width,
                       size - 2 * line_width)
+        self.progress_pen = QPen(QColor(self.progress_color).darker(), line_width, Qt.SolidLine)
+        self.partial_pen = QPen(QColor(self.partial_color), line_width, Qt.SolidLine)
 
-        # Draw background circle
+        font_size = max(1, int(size * 0.1))  # Set font size relative to the widget size
+        self.lbl_progress.setFont(QFont("Arial", font_size, QFont.Weight.Bold))
+
+        font_size = max(1, int(size * 0.05))  # Set font size relative to the widget size
+        self.lbl_progress_count.setFont(QFont("Arial", font_size, QFont.Weight.DemiBold))
+        self.lbl_name.setFont(QFont("Arial", font_size, QFont.Weight.DemiBold))
+
+        # The background disc is redrawn lazily on the next paint
+        self.background_pixmap = None
+
+    def create_background_pixmap(self) -> QPixmap:
+        ratio = self.devicePixelRatioF()
+        pixmap = QPixmap(int(self.width() * ratio), int(self.height() * ratio))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.Antialiasing)
         painter.setPen(Qt.NoPen)
         painter.setBrush(self.bg_color)
-        painter.drawEllipse(rect)
+        painter.drawEllipse(self.ring_rect)
+        painter.end()
+        return pixmap
 
-        # Draw progress arc
-        painter.setBrush(Qt.NoBrush)
-        painter.setPen(QPen(QColor(self.progress_color).darker(), line_width, Qt.SolidLine))
-        arc_length = int(360 * (self.goal.current_progress / self.goal.target))  # Angle corresponding to the progress
-        painter.drawArc(rect, -90 * 16, -arc_length * 16)
+    def paintEvent(self, event):
+        with metrics.timed("ui.paint_seconds"):
+            self.paint_ring()
+        super().paintEvent(event)
 
+    def paint_ring(self):
+        if self.background_pixmap is None:
+            self.background_pixmap = self.create_background_pixmap()
 
-        font_size = int(size * 0.1)  # Set font size relative to the widget size
-        self.lbl_progress.setFont(QFont("Arial", font_size, QFont.Weight.Bold))
+        # Painter setup
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
 
-        font_size = int(size * 0.05)  # Set font size relative to the widget size
-        self.lbl_progress_count.setFont(QFont("Arial", font_size, QFont.Weight.DemiBold))
+        # Draw background circle
+        painter.drawPixmap(0, 0, self.background_pixmap)
 
-        font_size = int(size * 0.05)  # Set font size relative to the widget size
-        self.lbl_name.setFont(QFont("Arial", font_size, QFont.Weight.DemiBold))
+        # Draw progress arc
+        painter.setBrush(Qt.NoBrush)
+        painter.setPen(self.partial_pen if self.missing_servers else self.progress_pen)
+        arc_length = int(360 * (self.goal.current_progress / self.goal.target))  # Angle corresponding to the progress
+        painter.drawArc(self.ring_rect, -90 * 16, -arc_length * 16)
 
         # Finish painting
         painter.end()
 
-        super().paintEvent(event)
-
     def resizeEvent(self, event):
         # Restrict the widget size to the maximum width and height
         new_width = min(self.width(), self.max_width)
         new_height = min(self.height(), self.max_height)
-        self.resize(new_width, new_height)
+        if new_width != self.width() or new_height != self.height():
+            self.resize(new_width, new_height)
+        self.update_geometry()
         super().resizeEvent(event)
 
 
@@ -1,8 +1,11 @@
 import sys, json
-from PyQt5.QtCore import Qt, pyqtSignal
+from collections import deque
+from PyQt5.QtCore import Qt, pyqtSignal, QTimer
 from PyQt5.QtWidgets import QApplication, QMainWindow, QTreeView, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QLabel, QCheckBox
 from PyQt5.QtGui import QStandardItemModel, QStandardItem
 
+from goaltracker.awfetcher import filter_fingerprint
+
 class AwFilterTreeView(QTreeView):
     def __init__(self, parent : QWidget = None):
         super().__init__(parent)
@@ -20,6 +23,9 @@ class AwFilterTreeView(QTreeView):
 
 class FilterConfiguration(QWidget):
     signal_close_window = pyqtSignal()
+    signal_filter_changed = pyqtSignal()
+
+    SAVE_DELAY = 1000 # ms, edits are saved once they settle
 
     def __init__(self, parent : QWidget = None, data : dict = None, filter_afk: bool = False):
         super().__init__(parent)
@@ -36,6 +42,22 @@ class FilterConfiguration(QWidget):
 
         self.filter_afk = filter_afk
 
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(self.SAVE_DELAY)
+        self.save_timer.timeout.connect(self.save_settings)
+
+        # Bumped on every model edit, compiled outputs are cached per revision
+        self.model_revision = 0
+        self.cache_revision = -1
+        self.cache = {}
+        # Revision and afk setting when the window was opened or last saved, closing saves only when they changed
+        self.saved_revision = self.model_revision
+        self.saved_filter_afk = filter_afk
+        for model_signal in (self.model.dataChanged, self.model.rowsInserted, self.model.rowsRemoved,
+                self.model.rowsMoved, self.model.modelReset, self.model.layoutChanged):
+            model_signal.connect(self.on_model_changed)
+
         # Populate the tree with data
         if not data is None:
             self.from_dict(data)
@@ -73,12 +95,41 @@ class FilterConfiguration(QWidget):
 
         self.model.dataChanged.connect(self.on_data_changed)
 
+    def showEvent(self, event):
+        self.mark_saved()
+        super().showEvent(event)
+
     def closeEvent(self, event):
+        # Pending or unsaved edits are saved on close, a window closed without edits saves nothing
+        if self.save_timer.isActive() or self.model_revision != self.saved_revision or self.filter_afk != self.saved_filter_afk:
+            self.save_settings()
         self.signal_close_window.emit()
         super().closeEvent(event)
 
+    def mark_saved(self):
+        self.saved_revision = self.model_revision
+        self.saved_filter_afk = self.filter_afk
+
+    def on_model_changed(self, *args):
+        self.model_revision += 1
+
+    def get_cached(self, name : str, create):
+        if self.cache_revision != self.model_revision:
+            self.cache = {}
+            self.cache_revision = self.model_revision
+        if name not in self.cache:
+            self.cache[name] = create()
+        return self.cache[name]
+
+    def get_filter_json(self) -> str:
+        return self.get_cached("filter_json", lambda: json.dumps(self.to_aw_filter(), sort_keys=True))
+
+    def get_filter_fingerprint(self, filter_afk : bool, utc_offset = None, hostname : str = None, server_urls : tuple = None) -> str:
+        return self.get_cached(("fingerprint", bool(filter_afk), utc_offset, hostname, server_urls),
+            lambda: filter_fingerprint(self.to_aw_filter(), filter_afk, utc_offset, self.get_filter_json(), hostname, server_urls))
+
     def on_data_changed(self, top_left, bottom_right, roles):
-        self.save_settings()
+        self.schedule_save()
     
     def on_delete_clicked(self):
         self.delete_selected()
@@ -101,25 +152,35 @@ class FilterConfiguration(QWidget):
 
         # Add the new row as a child of the double-clicked item
         item.appendRow([new_child, new_child_checkbox, new_child_desc])
-        self.save_settings()
+        self.schedule_save()
 
     def on_filter_afk_checkbox_change(self, state):
         self.filter_afk = state == Qt.Checked
+        self.schedule_save()
+
+    def schedule_save(self):
+        # Restarting the timer coalesces bursts of edits, e.g. typing a regex, into one save
+        self.save_timer.start()
+
+    def flush_pending_save(self):
+        if self.save_timer.isActive():
+            self.save_settings()
 
     def save_settings(self):
-        with open("temp.txt", "w")  as fl:
-            json.dump(self.to_dict(), fl, indent=4)
+        self.save_timer.stop()
+        self.mark_saved()
+        self.signal_filter_changed.emit()
 
     def from_dict(self, data : dict):
         
         if "sub_categories" not in data.keys():
             return
 
-        category_stack = []
+        category_stack = deque()
         category_stack.append([None, data["sub_categories"]])
         parent = None
         while len(category_stack) > 0:
-            parent, sub_categories = category_stack.pop(0)
+            parent, sub_categories = category_stack.popleft()
 
             for category_info in sub_categories:
                 category = QStandardItem(category_info["category"])
@@ -154,7 +215,7 @@ class FilterConfiguration(QWidget):
                 parent_item.removeRow(selected_row)
             else:
                 self.model.removeRow(selected_row)
-            self.save_settings()
+            self.schedule_save()
 
     def keyPressEvent(self, event):
         # Check if the Delete key is pressed
@@ -166,10 +227,13 @@ class FilterConfiguration(QWidget):
         super().keyPressEvent(event)
 
     def get_filter_categories(self) -> list:
+        return self.get_cached("filter_categories", self.create_filter_categories)
+
+    def create_filter_categories(self) -> list:
         result = []
-        categories_stack = [[None, self.model]]
+        categories_stack = deque([[None, self.model]])
         while len(categories_stack) > 0:
-            parent_path, category = categories_stack.pop(0)
+            parent_path, category = categories_stack.popleft()
             if parent_path is None:
                 parent_path = []
                 get_child = self.model.item
@@ -185,10 +249,13 @@ class FilterConfiguration(QWidget):
         return result
 
     def to_aw_filter(self) -> list:
-        categories_stack = [[None, self.model]]
+        return self.get_cached("aw_filter", self.create_aw_filter)
+
+    def create_aw_filter(self) -> list:
+        categories_stack = deque([[None, self.model]])
         result = []
         while len(categories_stack) > 0:
-            parent_path, category = categories_stack.pop(0)
+            parent_path, category = categories_stack.popleft()
             if parent_path is None:
                 parent_path = []
                 get_child = self.model.item
@@ -209,10 +276,13 @@ class FilterConfiguration(QWidget):
         return result
     
     def to_dict(self):
-        categories_stack = [[None, self.model]]
+        return self.get_cached("dict", self.create_dict)
+
+    def create_dict(self):
+        categories_stack = deque([[None, self.model]])
         result = {"sub_categories" : []}
         while len(categories_stack) > 0:
-            parent_dict, category = categories_stack.pop(0)
+            parent_dict, category = categories_stack.popleft()
             if parent_dict is None:
                 parent_dict = result
                 get_child = self.model.item
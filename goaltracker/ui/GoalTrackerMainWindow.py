@@ -1,14 +1,16 @@
-import json
-from datetime import datetime
-
-from PyQt5.QtCore import Qt, QPoint, QSettings
+from PyQt5.QtCore import Qt, QPoint, QSettings, QTimer, QEvent
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, \
     QHBoxLayout
 
 from goaltracker.ui.CircularProgress import CircularProgress
 from goaltracker.ui.FilterConfiguration import FilterConfiguration
+from goaltracker.ui.RefreshScheduler import RefreshScheduler
+from goaltracker.ui.AsyncFetchEngine import FetchEngines
 from goaltracker.GoalTrackerDb import GoalTrackerDb
 from goaltracker.Goal import Goal
+from goaltracker.awtransport import set_server_settings
+from goaltracker.awmirror import EventMirror
+from goaltracker import metrics
 
 class GoalTrackerMainWindow(QWidget):
     def __init__(self):
@@ -18,38 +20,24 @@ class GoalTrackerMainWindow(QWidget):
         self.setWindowFlags(Qt.Tool | Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint)
         
         self.goal_tracker_db = GoalTrackerDb()
+        self.restore_aw_server_url()
+        settings = QSettings("goaltracker", "goaltracker")
+        self.refresh_scheduler = RefreshScheduler(goal_tracker_db=self.goal_tracker_db,
+            engine=settings.value("fetch_engine", FetchEngines.THREAD_POOL),
+            event_mirror=EventMirror() if settings.value("local_mirror", False, type=bool) else None, parent=self)
+        self.refresh_scheduler.signal_goals_progressed.connect(self.on_goals_progress)
 
         root_layout = QHBoxLayout(self)
 
         self.vbox = QVBoxLayout()
         root_layout.addLayout(self.vbox)
 
-        goals = self.goal_tracker_db.get_goals()
+        active_goals = self.goal_tracker_db.load_active_goals_with_filters()
 
         self.goal_widgets = []
 
-        if len(goals) > 0:
-            for agoal in goals:
-                goal_id, goal_name, goal_target,\
-                goal_current_progress, goal_type, \
-                goal_active, begin_date,\
-                end_date, filter_afk, creation_date = agoal
-                
-                # Convert unix timestamp to python datetime
-                if begin_date:
-                    begin_date = datetime.fromtimestamp(begin_date)
-                
-                if end_date:
-                    end_date = datetime.fromtimestamp(end_date)
-
-                goal = Goal(goal_id=goal_id, current_progress=goal_current_progress, name = goal_name, target = goal_target,
-                    goal_type=goal_type, begin_date=begin_date, end_date=end_date, filter_afk = filter_afk)
-                
-                goal_filter = self.goal_tracker_db.get_goal_filter(goal_id)
-                filter = None
-                if len(goal_filter) > 0:
-                    filter = json.loads(goal_filter[0][0])
-
+        if len(active_goals) > 0:
+            for goal, filter in active_goals:
                 self.create_and_register_goal_widget(goal=goal, filter=filter)
         else:
             self.add_place_holder_goal()
@@ -60,38 +48,83 @@ class GoalTrackerMainWindow(QWidget):
         self.drag_position = QPoint()
     
         self.restore_window_geometry()
+
+        self.goal_tracker_db.downsample_progress_history()
+        self.history_timer = QTimer(self)
+        self.history_timer.timeout.connect(self.goal_tracker_db.downsample_progress_history)
+        self.history_timer.setInterval(60 * 60 * 1000) # 1 hour intervals
+        self.history_timer.start()
+
+        # Snapshots for offline analysis, only when a metrics file is configured
+        if metrics.METRICS_FILE:
+            self.metrics_timer = QTimer(self)
+            self.metrics_timer.timeout.connect(lambda: metrics.get_metrics().dump_json_lines(metrics.METRICS_FILE))
+            self.metrics_timer.setInterval(metrics.DUMP_INTERVAL * 1000)
+            self.metrics_timer.start()
     
     def save_window_geometry(self):
         settings = QSettings("goaltracker", "goaltracker")
         settings.setValue("geometry", self.saveGeometry())
 
+    def save_pending_filters(self):
+        for widget in self.goal_widgets:
+            widget.flush_pending_filter_save()
+
+    def shutdown_fetches(self):
+        self.refresh_scheduler.shutdown()
+
     def restore_window_geometry(self):
         settings = QSettings("goaltracker", "goaltracker")
         geometry = settings.value("geometry")
         if geometry:
             self.restoreGeometry(geometry)
     
+    def restore_aw_server_url(self):
+        # Copied to the db so the headless report asks the same servers as the widget
+        settings = QSettings("goaltracker", "goaltracker")
+        for key in ("aw_server_url", "aw_server_urls"):
+            value = settings.value(key)
+            if isinstance(value, list):
+                value = ",".join(value)
+            self.goal_tracker_db.set_setting(key, str(value) if value else None)
+        # Further servers in aw_server_urls are added to every goal
+        set_server_settings(self.goal_tracker_db.get_setting("aw_server_url"), self.goal_tracker_db.get_setting("aw_server_urls"))
+
     def create_and_register_goal_widget(self, goal : Goal, filter : dict = None):
         goal_widget = CircularProgress(goal=goal, filter = filter)
         goal_widget.signal_goal_edited.connect(self.on_goal_update)
-        goal_widget.signal_goal_progressed.connect(self.on_goal_progress)
         goal_widget.signal_filter_update.connect(self.on_filter_update)
         goal_widget.signal_remove.connect(self.on_progress_delete)
+        goal_widget.signal_refresh.connect(self.on_progress_refresh)
+        self.refresh_scheduler.register(goal_widget)
         self.vbox.addWidget(goal_widget)
         self.goal_widgets.append(goal_widget)
 
     def on_goal_update(self, goal : Goal):
+        self.refresh_scheduler.goal_registry.invalidate_period(goal)
         self.goal_tracker_db.update_goal(goal)
+        self.restart_goal_refresh(goal.goal_id)
     
-    def on_goal_progress(self, goal : Goal):
-        self.goal_tracker_db.update_goal_progress(goal.goal_id, goal.current_progress)
+    def on_goals_progress(self, goals : list):
+        self.goal_tracker_db.update_goals_progress([(goal.goal_id, goal.current_progress) for goal in goals])
 
     def on_filter_update(self, goal_id : int, filterConfig : FilterConfiguration):
-        self.goal_tracker_db.update_goal_filter_afk(goal_id, filterConfig.filter_afk)
-        self.goal_tracker_db.update_goal_filter(goal_id, filterConfig.to_dict())
+        self.goal_tracker_db.update_goal_filter_settings(goal_id, filterConfig.to_dict(), filterConfig.filter_afk)
+        self.restart_goal_refresh(goal_id)
+
+    def restart_goal_refresh(self, goal_id : int):
+        # Drop the in flight fetch of the old goal settings and fetch again
+        self.refresh_scheduler.cancel(goal_id)
+        for widget in self.goal_widgets:
+            if widget.goal.goal_id == goal_id:
+                self.refresh_scheduler.refresh([widget])
+
+    def on_progress_refresh(self, widget : CircularProgress):
+        self.refresh_scheduler.refresh([widget])
 
     def on_progress_delete(self, widget : CircularProgress):
         widget.goal.active = 0
+        self.refresh_scheduler.unregister(widget)
         self.goal_tracker_db.deactivate_goal(widget.goal.goal_id)
         self.vbox.removeWidget(widget)
         self.goal_widgets.remove(widget)
@@ -104,6 +137,19 @@ class GoalTrackerMainWindow(QWidget):
         goal.goal_id = self.goal_tracker_db.add_goal(goal)
         self.create_and_register_goal_widget(goal=goal)
 
+    def showEvent(self, event):
+        self.refresh_scheduler.set_visible(not self.isMinimized())
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.refresh_scheduler.set_visible(False)
+        super().hideEvent(event)
+
+    def changeEvent(self, event):
+        if event.type() == QEvent.WindowStateChange:
+            self.refresh_scheduler.set_visible(self.isVisible() and not self.isMinimized())
+        super().changeEvent(event)
+
     def mouseDoubleClickEvent(self, event):
         self.add_place_holder_goal()
     
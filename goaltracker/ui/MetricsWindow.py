@@ -0,0 +1,108 @@
+import sys
+
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, \
+    QTableWidget, QTableWidgetItem, QPushButton, QLabel, QHeaderView
+
+from goaltracker.metrics import get_metrics, get_metrics_path
+
+class MetricsWindow(QWidget):
+    COLUMNS = ["Metric", "Count", "Mean", "p50", "p95", "Max"]
+    REFRESH_INTERVAL = 1000 # ms, only while the window is shown
+
+    def __init__(self, parent : QWidget = None):
+        super().__init__(parent)
+        self.setWindowTitle("Goal tracker metrics")
+        self.setGeometry(200, 100, 700, 400)
+        self.setWindowFlags(Qt.Tool)
+
+        layout = QVBoxLayout(self)
+
+        self.table = QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        self.lbl_status = QLabel("")
+        layout.addWidget(self.lbl_status)
+
+        buttons_layout = QHBoxLayout()
+        self.btn_dump = QPushButton("Dump to file")
+        self.btn_dump.clicked.connect(self.dump_metrics)
+        buttons_layout.addWidget(self.btn_dump)
+
+        self.btn_reset = QPushButton("Reset")
+        self.btn_reset.clicked.connect(self.reset_metrics)
+        buttons_layout.addWidget(self.btn_reset)
+        layout.addLayout(buttons_layout)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.update_table)
+        self.refresh_timer.setInterval(self.REFRESH_INTERVAL)
+
+    @staticmethod
+    def format_value(name : str, value) -> str:
+        if name.endswith("_seconds"):
+            return "{:.2f} ms".format(value * 1000)
+        if isinstance(value, float):
+            return "{:.2f}".format(value)
+        return str(value)
+
+    def update_table(self):
+        snapshot = get_metrics().snapshot()
+
+        rows = []
+        for name, value in sorted(snapshot["counters"].items()):
+            rows.append([name, self.format_value(name, value), "", "", "", ""])
+        for name, value in sorted(snapshot["gauges"].items()):
+            rows.append([name, "", "", "", "", self.format_value(name, value)])
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            if histogram["count"] < 1:
+                continue
+            rows.append([name, str(histogram["count"])] +
+                [self.format_value(name, histogram[key]) for key in ["mean", "p50", "p95", "max"]])
+
+        self.table.setRowCount(len(rows))
+        for row_index, row in enumerate(rows):
+            for column_index, text in enumerate(row):
+                self.table.setItem(row_index, column_index, QTableWidgetItem(text))
+
+    def dump_metrics(self):
+        path = get_metrics_path()
+        try:
+            get_metrics().dump_json_lines(path)
+            self.lbl_status.setText("Appended to {}".format(path))
+        except OSError as e:
+            self.lbl_status.setText("Could not write {}: {}".format(path, e))
+
+    def reset_metrics(self):
+        get_metrics().reset()
+        self.update_table()
+
+    def showEvent(self, event):
+        self.update_table()
+        self.refresh_timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+        super().hideEvent(event)
+
+_metrics_window = None
+
+def show_metrics_window():
+    # One window for the whole application, built on first use
+    global _metrics_window
+    if _metrics_window is None:
+        _metrics_window = MetricsWindow()
+    _metrics_window.show()
+    _metrics_window.raise_()
+
+if __name__ == "__main__":
+    app = QApplication(sys.argv)
+
+    show_metrics_window()
+
+    sys.exit(app.exec_())
@@ -0,0 +1,264 @@
+import time
+
+from PyQt5.QtCore import QObject, QTimer, QThreadPool, pyqtSignal
+
+from goaltracker.awfetcher import fetch_hours_batch, fetch_afk_state
+from goaltracker.awtransport import get_transport
+from goaltracker.RefreshPolicy import RefreshPolicy
+from goaltracker.GoalRegistry import GoalRegistry
+from goaltracker import metrics
+from goaltracker.ProgressAccumulator import ProgressAccumulator
+from goaltracker.GoalTrackerDb import GoalTrackerDb
+from goaltracker.awmirror import EventMirror
+from goaltracker.ui.AsyncFetchEngine import AsyncFetchEngine, FetchEngines
+
+class RefreshScheduler(QObject):
+    signal_fetch_results = pyqtSignal(object)
+    signal_goals_progressed = pyqtSignal(list)
+    signal_afk_state = pyqtSignal(object)
+
+    AFK_POLL_INTERVAL = 30 * 1000
+
+    def __init__(self, interval : int = 60 * 1000, incremental : bool = True, goal_tracker_db : GoalTrackerDb = None,
+            engine : str = FetchEngines.THREAD_POOL, event_mirror : EventMirror = None, parent : QObject = None):
+        super().__init__(parent)
+        self.widgets = []
+        # Targets and progress of the registered goals, completion is computed for all of them at once
+        self.goal_registry = GoalRegistry()
+        self.goal_tracker_db = goal_tracker_db
+        # When set progress is computed from the local copy of the buckets
+        self.event_mirror = event_mirror
+        # Bumped when a goal is edited or deleted, in flight results of older generations are dropped
+        self.goal_generations = {}
+
+        # In incremental mode totals of past days are kept and only the current day is queried
+        self.progress_accumulator = ProgressAccumulator() if incremental else None
+
+        # Every goal has its own due time, the timer is armed for the earliest one
+        self.refresh_policy = RefreshPolicy(base_interval=interval / 1000)
+        self.next_refresh = {}
+        self.afk_refreshes = {}
+        self.is_afk = False
+        self.is_visible = True
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.timeout.connect(self.on_refresh)
+
+        self.afk_timer = QTimer(self)
+        self.afk_timer.timeout.connect(self.on_afk_poll)
+        self.afk_timer.setInterval(self.AFK_POLL_INTERVAL)
+        self.afk_timer.start()
+        self.signal_afk_state.connect(self.on_afk_state)
+
+        # Fetches submitted and not answered yet, every fetch answers once even if it failed
+        self.fetches_in_flight = 0
+        self.fetch_thread_pool = QThreadPool(self)
+        self.async_fetch_engine = AsyncFetchEngine(parent=self) if engine == FetchEngines.ASYNCIO else None
+        # Emitted from the fetch thread, queued to the gui thread that owns the widgets and the db connection
+        self.signal_fetch_results.connect(self.on_fetch_results)
+
+        # Results arriving in the same event loop iteration are delivered together
+        self.delivered_results = []
+        self.delivery_timer = QTimer(self)
+        self.delivery_timer.setSingleShot(True)
+        self.delivery_timer.setInterval(0)
+        self.delivery_timer.timeout.connect(self.deliver_results)
+
+    def register(self, widget):
+        if widget not in self.widgets:
+            self.widgets.append(widget)
+            self.goal_registry.add(widget.goal)
+            self.next_refresh[widget] = time.monotonic()
+            self.schedule_refresh()
+
+    def unregister(self, widget):
+        if widget in self.widgets:
+            self.widgets.remove(widget)
+        self.goal_registry.remove(widget.goal)
+        self.next_refresh.pop(widget, None)
+        self.afk_refreshes.pop(widget, None)
+        if not self.progress_accumulator is None:
+            self.progress_accumulator.invalidate(widget.goal.goal_id)
+        self.cancel(widget.goal.goal_id)
+
+    def shutdown(self):
+        self.refresh_timer.stop()
+        self.afk_timer.stop()
+        if not self.async_fetch_engine is None:
+            self.async_fetch_engine.shutdown()
+
+    def cancel(self, key):
+        self.goal_generations[key] = self.goal_generations.get(key, 0) + 1
+        if not self.async_fetch_engine is None:
+            self.async_fetch_engine.cancel(key)
+
+    def schedule_refresh(self):
+        if len(self.next_refresh) < 1:
+            self.refresh_timer.stop()
+            return
+        delay = min(self.next_refresh.values()) - time.monotonic()
+        self.refresh_timer.start(max(0, int(delay * 1000)))
+
+    def get_refresh_interval(self, widget, completed : list = None) -> float:
+        # completed is GoalRegistry.get_completed of all goals when several widgets are planned together
+        return self.refresh_policy.get_interval(widget.goal, is_afk=self.is_afk, is_visible=self.is_visible,
+            afk_refreshes=self.afk_refreshes.get(widget, 0),
+            completed=None if completed is None or widget.goal.registry is None else completed[widget.goal.registry_index])
+
+    def plan_next_refresh(self, widget, completed : list = None):
+        self.next_refresh[widget] = time.monotonic() + self.get_refresh_interval(widget, completed)
+        if self.is_afk:
+            self.afk_refreshes[widget] = self.afk_refreshes.get(widget, 0) + 1
+
+    def refresh_all_now(self):
+        now = time.monotonic()
+        for widget in self.widgets:
+            self.next_refresh[widget] = now
+        self.schedule_refresh()
+
+    def set_visible(self, is_visible : bool):
+        if is_visible == self.is_visible:
+            return
+        self.is_visible = is_visible
+        if is_visible:
+            # Show fresh numbers as soon as the window comes back
+            self.refresh_all_now()
+
+    def on_afk_poll(self):
+        if not self.is_visible:
+            return
+        self.fetch_thread_pool.start(lambda: self.signal_afk_state.emit(fetch_afk_state()))
+
+    def on_afk_state(self, is_afk):
+        # An unreachable server is treated as active so the regular interval applies
+        is_afk = bool(is_afk)
+        if is_afk == self.is_afk:
+            return
+        self.is_afk = is_afk
+        if not is_afk:
+            self.afk_refreshes.clear()
+            self.refresh_all_now()
+
+    def on_refresh(self):
+        now = time.monotonic()
+        self.refresh([widget for widget in self.widgets if self.next_refresh.get(widget, now) <= now])
+
+    def refresh(self, widgets : list = None):
+        if widgets is None:
+            widgets = self.widgets
+
+        completed = self.goal_registry.get_completed()
+        for widget in widgets:
+            if widget in self.widgets:
+                self.plan_next_refresh(widget, completed)
+        self.schedule_refresh()
+
+        # Queries are built here on the gui thread since they read the filter models
+        pending = []
+        for widget in widgets:
+            goal_query = widget.create_goal_query()
+            if not goal_query is None:
+                pending.append((widget, goal_query))
+
+        if len(pending) < 1:
+            return
+
+        goal_queries = [goal_query for _, goal_query in pending]
+        self.load_daily_progress(goal_queries)
+        generations = {goal_query.key: self.goal_generations.get(goal_query.key, 0) for goal_query in goal_queries}
+
+        self.fetches_in_flight += 1
+        metrics.set_gauge("fetch.queue_depth", self.fetches_in_flight)
+        submitted = time.perf_counter()
+
+        # goal key -> servers that did not answer, filled by the fetch thread
+        partial = {}
+
+        def on_results(results : dict):
+            metrics.observe("fetch.refresh_seconds", time.perf_counter() - submitted)
+            self.signal_fetch_results.emit((pending, generations, results, partial))
+
+        # The mirror and the async engine only know the main server, goals counted
+        # on other servers are always fetched by the thread pool
+        main_server_url = get_transport().server_url
+        if any(goal_query.get_server_urls() != (main_server_url,) for goal_query in goal_queries):
+            self.fetch_thread_pool.start(lambda: self.fetch_data(goal_queries, partial, on_results, use_mirror=False))
+            return
+
+        if not self.async_fetch_engine is None and self.event_mirror is None:
+            self.async_fetch_engine.submit(goal_queries, self.progress_accumulator, on_results)
+            return
+
+        self.fetch_thread_pool.start(lambda: self.fetch_data(goal_queries, partial, on_results))
+
+    def fetch_data(self, goal_queries : list, partial : dict, on_results, use_mirror : bool = True):
+        results = {}
+        sync_mirror = False
+        try:
+            if not self.event_mirror is None and use_mirror:
+                # Answered from the local copy first, new events are pulled afterwards and counted on
+                # the next refresh so a slow server never holds back the answer. Goals whose buckets
+                # the mirror does not have yet wait for the sync.
+                results = self.event_mirror.fetch_hours_batch(goal_queries)
+                if any(hours is None for hours in results.values()):
+                    self.event_mirror.sync()
+                    results = self.event_mirror.fetch_hours_batch(goal_queries)
+                else:
+                    sync_mirror = True
+            elif self.progress_accumulator is None:
+                results = fetch_hours_batch(goal_queries, partial)
+            else:
+                results = self.progress_accumulator.fetch_hours(goal_queries, partial=partial)
+        finally:
+            on_results(results)
+        if sync_mirror:
+            self.event_mirror.sync(wait=False)
+
+    def load_daily_progress(self, goal_queries : list):
+        if self.progress_accumulator is None or self.goal_tracker_db is None:
+            return
+        self.progress_accumulator.load_daily_progress(self.goal_tracker_db, goal_queries)
+
+    def on_fetch_results(self, fetch_results : tuple):
+        self.fetches_in_flight -= 1
+        metrics.set_gauge("fetch.queue_depth", self.fetches_in_flight)
+        self.delivered_results.append(fetch_results)
+        metrics.set_gauge("ui.delivery_queue", len(self.delivered_results))
+        if not self.delivery_timer.isActive():
+            self.delivery_timer.start()
+
+    def deliver_results(self):
+        delivered_results = self.delivered_results
+        self.delivered_results = []
+
+        # Latest result of every widget wins, labels are set and repaints are only
+        # scheduled so the whole batch costs a single layout and paint pass.
+        progressed = {}
+        for pending, generations, results, partial in delivered_results:
+            for widget, goal_query in pending:
+                hours = results.get(goal_query.key)
+                if hours is None or widget not in self.widgets:
+                    continue
+                if generations[goal_query.key] == self.goal_generations.get(goal_query.key, 0):
+                    progressed[widget] = (hours, partial.get(goal_query.key))
+
+        for widget, (hours, missing_servers) in progressed.items():
+            widget.on_goal_progress(hours, missing_servers)
+
+        # The interval depends on how close the goal now is to its target
+        completed = self.goal_registry.get_completed()
+        for widget in progressed.keys():
+            if widget in self.next_refresh:
+                self.next_refresh[widget] = min(self.next_refresh[widget], time.monotonic() + self.get_refresh_interval(widget, completed))
+        if len(progressed) > 0:
+            self.schedule_refresh()
+
+        self.store_daily_progress()
+        if len(progressed) > 0:
+            self.signal_goals_progressed.emit([widget.goal for widget in progressed.keys()])
+
+    def store_daily_progress(self):
+        if self.progress_accumulator is None or self.goal_tracker_db is None:
+            return
+        self.progress_accumulator.store_daily_progress(self.goal_tracker_db)